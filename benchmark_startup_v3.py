@@ -0,0 +1,88 @@
+import argparse, datetime, json, statistics, subprocess, sys, time
+
+# Read-only commands by default; collect and verify can be passed explicitly
+DEFAULT_COMMANDS = [
+    '--help',
+    'clean-logs --dry-run',
+    'stats',
+    'test-db',
+    'recent-songs --limit 1 --json'
+]
+
+
+def parse_importtime(stderr):
+    """Return (total_self_us, module_count, [(cumulative_us, module)] for top-level imports) from -X importtime output"""
+    total = 0
+    modules = 0
+    top_level = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        total += int(self_us)
+        modules += 1
+        # Nested imports are indented under the module that triggered them
+        if not name[1:].startswith(' '):
+            top_level.append((int(cumulative_us), name.strip()))
+    return total, modules, top_level
+
+
+def run_command(script, command, timeout):
+    """Run one fresh interpreter for the command and return its wall time and import profile"""
+    started = time.perf_counter()
+    try:
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', script, *command.split()],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=timeout
+        )
+        exit_code, stderr = completed.returncode, completed.stderr
+    except subprocess.TimeoutExpired as e:
+        exit_code, stderr = None, e.stderr.decode(errors='replace') if isinstance(e.stderr, bytes) else (e.stderr or '')
+    wall_ms = (time.perf_counter() - started) * 1000
+    import_us, modules, top_level = parse_importtime(stderr)
+    return {'wall_ms': wall_ms, 'import_ms': import_us / 1000, 'modules': modules, 'exit_code': exit_code, 'top_level': top_level}
+
+
+def benchmark(script, commands, runs, timeout):
+    """Time every command runs times and summarize each one"""
+    results = []
+    for command in commands:
+        samples = [run_command(script, command, timeout) for _ in range(runs)]
+        slowest = sorted(samples[-1]['top_level'], reverse=True)[:5]
+        results.append({
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'script': script,
+            'command': command,
+            'runs': runs,
+            'wall_ms_min': round(min(s['wall_ms'] for s in samples), 1),
+            'wall_ms_median': round(statistics.median(s['wall_ms'] for s in samples), 1),
+            'import_ms_median': round(statistics.median(s['import_ms'] for s in samples), 1),
+            'modules': samples[-1]['modules'],
+            'exit_codes': sorted({s['exit_code'] for s in samples}, key=str),
+            'slowest_imports': [{'module': name, 'ms': round(us / 1000, 1)} for us, name in slowest]
+        })
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure cold-start latency and import cost of each CLI command')
+    parser.add_argument('commands', nargs='*', default=DEFAULT_COMMANDS, help='Commands to time, each as one quoted string (default: the read-only commands)')
+    parser.add_argument('--script', default='collect_playlists_v3.py', help='Script to run (default: collect_playlists_v3.py)')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per command (default: 5)')
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds before a run is killed (default: 60)')
+    parser.add_argument('--output', help='Append one JSON line per command to this file to track startup over time')
+    args = parser.parse_args()
+
+    results = benchmark(args.script, args.commands, args.runs, args.timeout)
+
+    for result in results:
+        print(f"⏱️  {result['command']}")
+        print(f"    wall: {result['wall_ms_median']} ms median, {result['wall_ms_min']} ms min (exit {', '.join(map(str, result['exit_codes']))})")
+        print(f"    imports: {result['import_ms_median']} ms across {result['modules']} modules")
+        for entry in result['slowest_imports']:
+            print(f"      {entry['module']}: {entry['ms']} ms")
+
+    if args.output:
+        with open(args.output, 'a') as file:
+            for result in results:
+                file.write(json.dumps(result) + '\n')
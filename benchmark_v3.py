@@ -0,0 +1,200 @@
+import argparse, collections, datetime, json, os, shutil, socket, subprocess, tempfile, threading, time
+from pymongo import monitoring
+from fake_spotify_v3 import FakeLibrary, FakeSpotifyServer
+
+# End-to-end benchmark: runs collect, verify and stats in-process against fake_spotify_v3 and a
+# local mongod, in a scratch directory with its own creds_v3.json, logs/ and database.
+
+DEFAULT_STEPS = ['collect', 'verify', 'stats', 'collect', 'stats-exact']
+
+
+class MongoCommandCounter(monitoring.CommandListener):
+    """pymongo command listener counting round trips per collection and command"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = collections.Counter()
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        name = f"{target}.{event.command_name}" if isinstance(target, str) else event.command_name
+        with self.lock:
+            self.commands[name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def take(self) -> dict:
+        """Return and reset the counts"""
+        with self.lock:
+            commands = dict(self.commands)
+            self.commands.clear()
+        return commands
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_mongod(mongod_path, dbpath):
+    """Start a throwaway mongod on a free port and return (process, port) once it accepts connections"""
+    port = free_port()
+    process = subprocess.Popen(
+        [mongod_path, '--dbpath', dbpath, '--port', str(port), '--bind_ip', '127.0.0.1', '--quiet'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, port
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"mongod exited with {process.returncode}")
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('mongod did not start within 30s')
+
+
+def write_creds(workdir, server, library, args, mongo_port):
+    creds = {
+        'client_id': 'benchmark',
+        'client_secret': 'benchmark',
+        'redirect_uri': 'http://localhost',
+        'auth_token': '',
+        'access_token': [''],
+        'refresh_token': ['benchmark'],
+        'expires_readable': '',
+        'expires_integer': 0,
+        **library.creds_config(),
+        'concurrency': {'playlist_workers': args.playlist_workers, 'page_workers': args.page_workers},
+        'http': {'api_url': server.url, 'accounts_url': server.url, 'pool_size': 16, 'timeout': 10, 'max_retries': 5},
+        'mongodb': {'host': '127.0.0.1' if args.mongod else args.mongo_host, 'port': mongo_port, 'database': args.database}
+    }
+    with open(os.path.join(workdir, 'creds_v3.json'), 'w') as file:
+        json.dump(creds, file, indent=4)
+
+
+def run_benchmark(args):
+    library = FakeLibrary(args.playlists, args.tracks, args.liked, args.artists, seed=args.seed)
+    server = FakeSpotifyServer(
+        library,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        rate_limit_rate=args.rate_limit,
+        retry_after=args.retry_after,
+        seed=args.seed
+    ).start()
+
+    workdir = tempfile.mkdtemp(prefix='spotify_benchmark_')
+    os.makedirs(os.path.join(workdir, 'logs', 'json'))
+    mongod = None
+    mongo_port = args.mongo_port
+    if args.mongod:
+        os.makedirs(os.path.join(workdir, 'db'))
+        mongod, mongo_port = start_mongod(args.mongod, os.path.join(workdir, 'db'))
+
+    write_creds(workdir, server, library, args, mongo_port)
+    original_cwd = os.getcwd()
+    os.chdir(workdir)
+
+    # Registered before the shared client exists so it sees every command
+    mongo_counter = MongoCommandCounter()
+    monitoring.register(mongo_counter)
+
+    try:
+        import collect_playlists_v3 as collector
+        from mongo_v3 import close_client, get_client
+
+        collector.initialize('benchmark_v3')
+        collector.configure()
+        if not args.keep_database:
+            get_client().drop_database(args.database)
+        collector.setup_mongodb_indexes()
+
+        steps = {
+            'collect': lambda: collector.collect_playlists_v3(setup_indexes=False),
+            'verify': collector.verify_song_additions,
+            'stats': lambda: collector.get_statistics(),
+            'stats-exact': lambda: collector.get_statistics(exact=True)
+        }
+
+        results = []
+        server.reset_stats()
+        mongo_counter.take()
+        for step in args.steps:
+            started = time.perf_counter()
+            steps[step]()
+            wall_s = time.perf_counter() - started
+            api = server.stats()
+            server.reset_stats()
+            mongo_commands = mongo_counter.take()
+            results.append({
+                'step': step,
+                'wall_s': round(wall_s, 3),
+                'api_calls': api['total'],
+                'api_rate_limited': sum(api['rate_limited'].values()),
+                'api_by_endpoint': api['calls'],
+                'mongo_round_trips': sum(mongo_commands.values()),
+                'mongo_by_command': mongo_commands
+            })
+
+        collector.response_capture.close()
+        close_client()
+        return results
+    finally:
+        os.chdir(original_cwd)
+        server.stop()
+        if mongod:
+            mongod.terminate()
+            mongod.wait()
+        if args.keep_workdir:
+            print(f"Scratch directory kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark collect, verify and stats against a fake Spotify API and a local mongod')
+    parser.add_argument('--steps', nargs='+', default=DEFAULT_STEPS, choices=['collect', 'verify', 'stats', 'stats-exact'], help=f"Steps to run in order (default: {' '.join(DEFAULT_STEPS)})")
+    parser.add_argument('--playlists', type=int, default=3, help='Yearly playlists (default: 3)')
+    parser.add_argument('--tracks', type=int, default=500, help='Tracks per yearly playlist (default: 500)')
+    parser.add_argument('--liked', type=int, default=200, help='Liked songs to process (default: 200)')
+    parser.add_argument('--artists', type=int, default=300, help='Distinct artists (default: 300)')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Latency added to every API call (default: 20)')
+    parser.add_argument('--latency-jitter-ms', type=float, default=10, help='Random extra latency of up to this much (default: 10)')
+    parser.add_argument('--rate-limit', type=float, default=0, help='Fraction of API calls answered with 429 (default: 0)')
+    parser.add_argument('--retry-after', type=int, default=0, help='Retry-After seconds sent with injected 429s (default: 0)')
+    parser.add_argument('--playlist-workers', type=int, default=1)
+    parser.add_argument('--page-workers', type=int, default=1)
+    parser.add_argument('--mongo-host', default='localhost')
+    parser.add_argument('--mongo-port', type=int, default=27017)
+    parser.add_argument('--mongod', help='Path to a mongod binary to start a throwaway server instead of using --mongo-host/--mongo-port')
+    parser.add_argument('--database', default='spotify_collector_benchmark', help='Database to use; it is dropped first (default: spotify_collector_benchmark)')
+    parser.add_argument('--keep-database', action='store_true', help="Don't drop the database before running")
+    parser.add_argument('--keep-workdir', action='store_true', help='Keep the scratch directory with its creds and logs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Append the results as one JSON line to this file')
+    args = parser.parse_args()
+
+    if not args.keep_database and 'benchmark' not in args.database:
+        parser.error('--database is dropped before the run, so its name must contain "benchmark"')
+
+    results = run_benchmark(args)
+
+    print(f"📈 {args.playlists} playlists × {args.tracks} tracks, {args.liked} liked, {args.latency_ms} ms latency, {args.rate_limit:.0%} 429s")
+    for result in results:
+        print(f"  {result['step']:<12} {result['wall_s']:>8.2f}s  {result['api_calls']:>5} API calls ({result['api_rate_limited']} rate limited)  {result['mongo_round_trips']:>5} Mongo round trips")
+        for endpoint, count in sorted(result['api_by_endpoint'].items(), key=lambda item: -item[1]):
+            print(f"      {count:>5}  {endpoint}")
+        for command, count in sorted(result['mongo_by_command'].items(), key=lambda item: -item[1])[:8]:
+            print(f"      {count:>5}  mongo {command}")
+
+    if args.output:
+        with open(args.output, 'a') as file:
+            file.write(json.dumps({'time': datetime.datetime.now().isoformat(timespec='seconds'), 'config': vars(args), 'results': results}) + '\n')
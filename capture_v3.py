@@ -0,0 +1,183 @@
+import argparse, atexit, datetime, gzip, json, logging, os, queue, random, sys, threading
+
+# Fraction of responses captured when the 'capture' section doesn't say
+DEFAULT_SAMPLE_RATE = 0.1
+
+
+class ResponseCapture:
+    """Opt-in, sampled capture of raw Spotify responses into gzip-compressed JSON-lines segments
+
+    Records are handed to a background thread so the request thread never touches the disk.
+    Segments are append-only and rotated at segment_bytes. Once the capture directory holds
+    max_bytes of segments, further records are dropped.
+    """
+
+    # zlib buffers internally, so flush every this many uncompressed bytes to keep size accounting honest
+    FLUSH_BYTES = 64 * 1024
+
+    def __init__(self, directory='logs/capture', enabled=False, sample_rate=DEFAULT_SAMPLE_RATE, max_bytes=50_000_000, segment_bytes=5_000_000):
+        self.directory = directory
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.dropped = 0
+        self.queue = None
+        self.thread = None
+
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            self.queue = queue.Queue(maxsize=1000)
+            self.thread = threading.Thread(target=self._writer, name='response-capture', daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a capture from the optional 'capture' section of creds_v3.json"""
+        return cls(
+            directory=config.get('directory', 'logs/capture'),
+            enabled=config.get('enabled', False),
+            sample_rate=config.get('sample_rate', DEFAULT_SAMPLE_RATE),
+            max_bytes=config.get('max_bytes', 50_000_000),
+            segment_bytes=config.get('segment_bytes', 5_000_000)
+        )
+
+    def record(self, kind, response, **fields):
+        """Queue one response for capture if capturing is on and it is sampled; never blocks"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return
+        entry = {'time': datetime.datetime.now().isoformat(), 'kind': kind, **fields, 'response': response}
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Flush queued records and close the current segment"""
+        if not self.thread or not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join()
+        if self.dropped:
+            logging.warning(f"Response capture dropped {self.dropped} records")
+
+    def _writer(self):
+        used_bytes = sum(size for _, size in list_segments(self.directory))
+        segment = None
+        raw = None
+        unflushed = 0
+
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                break
+
+            if raw is not None and raw.tell() >= self.segment_bytes:
+                segment.close()
+                raw.close()
+                segment = raw = None
+
+            if used_bytes >= self.max_bytes:
+                self.dropped += 1
+                continue
+
+            if segment is None:
+                path = os.path.join(self.directory, f"capture_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S_%f')}.jsonl.gz")
+                raw = open(path, 'ab')
+                segment = gzip.GzipFile(fileobj=raw, mode='ab')
+                unflushed = 0
+
+            before = raw.tell()
+            line = (json.dumps(entry, separators=(',', ':')) + '\n').encode('utf-8')
+            segment.write(line)
+            unflushed += len(line)
+            if unflushed >= self.FLUSH_BYTES:
+                segment.flush()
+                unflushed = 0
+            used_bytes += raw.tell() - before
+
+        if segment is not None:
+            segment.close()
+            raw.close()
+
+
+def list_segments(directory):
+    """Return (path, size) for every capture segment in directory, oldest first"""
+    if not os.path.isdir(directory):
+        return []
+    with os.scandir(directory) as entries:
+        segments = [(entry.path, entry.stat().st_size) for entry in entries if entry.name.endswith('.jsonl.gz')]
+    return sorted(segments)
+
+
+def read_records(directory):
+    """Yield every captured record, oldest segment first"""
+    for path, _ in list_segments(directory):
+        with gzip.open(path, 'rt', encoding='utf-8') as segment:
+            for line in segment:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line of a segment can be cut short if the process was killed
+                    break
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or replay captured Spotify API responses')
+    parser.add_argument('--dir', default='logs/capture', help='Capture directory (default: logs/capture)')
+    subparsers = parser.add_subparsers(dest='command', help='Available commands')
+
+    subparsers.add_parser('list', help='List capture segments and their sizes')
+
+    show_parser = subparsers.add_parser('show', help='Print captured records as indented JSON')
+    show_parser.add_argument('--playlist', help='Only records for this playlist id or name')
+    show_parser.add_argument('--offset', type=int, help='Only records for this page offset')
+    show_parser.add_argument('--limit', type=int, default=10, help='Maximum records to print (default: 10)')
+
+    dump_parser = subparsers.add_parser('dump', help='Stream captured responses to stdout as JSON lines')
+    dump_parser.add_argument('--kind', help='Only records of this kind, e.g. playlist_tracks')
+
+    replay_parser = subparsers.add_parser('replay', help='Serve the captured playlists back to the collector as a local Spotify API')
+    replay_parser.add_argument('--host', default='127.0.0.1')
+    replay_parser.add_argument('--port', type=int, default=8765)
+
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        segments = list_segments(args.dir)
+        for path, size in segments:
+            print(f"  {os.path.basename(path)}: {size / 1024:.1f} KB")
+        print(f"{len(segments)} segments, {sum(size for _, size in segments) / 1024 / 1024:.2f} MB total")
+
+    elif args.command == 'show':
+        shown = 0
+        for record in read_records(args.dir):
+            if args.playlist and args.playlist not in (record.get('playlist_id'), record.get('playlist_name')):
+                continue
+            if args.offset is not None and record.get('offset') != args.offset:
+                continue
+            print(json.dumps(record, indent=4))
+            shown += 1
+            if shown >= args.limit:
+                break
+
+    elif args.command == 'dump':
+        for record in read_records(args.dir):
+            if args.kind and record.get('kind') != args.kind:
+                continue
+            sys.stdout.write(json.dumps(record['response']) + '\n')
+
+    elif args.command == 'replay':
+        from fake_spotify_v3 import FakeLibrary, FakeSpotifyServer
+        library = FakeLibrary.from_capture(read_records(args.dir))
+        server = FakeSpotifyServer(library, args.host, args.port)
+        print(f"🔁 Replaying {len(library.playlists)} captured playlists on {server.url}")
+        print("Point 'http.api_url' and 'http.accounts_url' in creds_v3.json at it")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+    else:
+        parser.print_help()
@@ -1,56 +1,89 @@
 from utilities_v3 import *
-import pymongo
-from pymongo import MongoClient
-from datetime import datetime, timedelta
+from capture_v3 import ResponseCapture
+from stats_v3 import count_recent_activity, increment_stats, read_stats, rebuild_stats
+from retention_v3 import load_policies, run_retention, run_retention_in_background
+from daemon_v3 import job_lock
+from metrics_v3 import metrics
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
 import os
 import argparse
 import sys
+import threading
 
-# MongoDB connection - get from credentials
-with open('creds_v3.json') as file:
-    credentials = json.load(file)
-
-# MongoDB connection details from credentials
-mongo_config = credentials.get('mongodb', {})
-mongo_host = mongo_config.get('host', 'localhost')
-mongo_port = mongo_config.get('port', 27017)
-mongo_db_name = mongo_config.get('database', 'spotify_collector')
-mongo_username = mongo_config.get('username', None)
-mongo_password = mongo_config.get('password', None)
-
-# Build connection string
-if mongo_username and mongo_password:
-    mongo_connection_string = f"mongodb://{mongo_username}:{mongo_password}@{mongo_host}:{mongo_port}/"
-else:
-    mongo_connection_string = f"mongodb://{mongo_host}:{mongo_port}/"
-
-mongo_client = MongoClient(mongo_connection_string)
-db = mongo_client[mongo_db_name]
-playlists_collection = db['playlists']
-songs_collection = db['songs']
-add_attempts_collection = db['add_attempts']
+# MongoDB connection - one shared, lazily created client (see mongo_v3.py)
+from mongo_v3 import (
+    db, pymongo, get_client, connection_string, database_name,
+    playlists_collection, songs_collection, add_attempts_collection, artists_collection, playlist_tracks_collection
+)
 
 # Configuration
 CACHE_REFRESH_DAYS = 30
 NEWEST_PLAYLIST_CHECK_SONGS = 50
+LIKED_TRACKS_BATCH_SIZE = 50
+ARTIST_CACHE_DAYS = 30
+
+PAGE_SIZE = 50
+
+# Concurrency - 1 worker keeps the old sequential behaviour. Set from creds_v3.json by configure()
+PLAYLIST_WORKERS = 1
+PAGE_WORKERS = 1
+
+# One page pool shared by every playlist worker, so PAGE_WORKERS caps page requests in flight overall
+_page_executor = None
+_page_executor_lock = threading.Lock()
+
+# Raw API response capture for debugging - off unless enabled in creds_v3.json
+response_capture = ResponseCapture()
+
+def configure(metrics_source='collect'):
+    """Load the credentials and apply their concurrency, capture and metrics sections"""
+    global PLAYLIST_WORKERS, PAGE_WORKERS, response_capture, _page_executor
+    load_credentials()
+    metrics.configure(credentials.get('metrics', {}), source=metrics_source)
+    concurrency_config = credentials.get('concurrency', {})
+    PLAYLIST_WORKERS = max(1, int(concurrency_config.get('playlist_workers', 1)))
+    PAGE_WORKERS = max(1, int(concurrency_config.get('page_workers', 1)))
+    with _page_executor_lock:
+        if _page_executor is not None:
+            _page_executor.shutdown()
+            _page_executor = None
+    response_capture.close()
+    response_capture = ResponseCapture.from_config(credentials.get('capture', {}))
 
 def setup_mongodb_indexes():
     """Create MongoDB indexes for better performance"""
+    from pymongo.errors import OperationFailure
+
     try:
         # Test connection first
-        mongo_client.admin.command('ping')
+        get_client().admin.command('ping')
         logging.info("MongoDB connection successful")
         
         playlists_collection.create_index("playlist_id", unique=True)
         songs_collection.create_index("song_id", unique=True)
-        songs_collection.create_index("date_added")
         songs_collection.create_index("date_cached")
-        songs_collection.create_index("logged")
         songs_collection.create_index("playlists")
+        # Shaped for get_recently_logged_songs: one index per $or branch, the first also giving the sort order.
+        # They cover every logged/date_added query, so the older single-field indexes are dropped.
+        songs_collection.create_index([("logged", 1), ("date_added", -1), ("_id", -1)])
+        songs_collection.create_index([("logged", 1), ("date_cached", -1)])
+        existing_indexes = songs_collection.index_information()
+        for redundant_index in ("date_added_1", "logged_1"):
+            if redundant_index in existing_indexes:
+                songs_collection.drop_index(redundant_index)
+                logging.info(f"Dropped redundant index songs.{redundant_index}")
+        songs_collection.create_index("summary_run", sparse=True)
         add_attempts_collection.create_index([("song_id", 1), ("playlist_id", 1)])
+        add_attempts_collection.create_index("attempt_time")
+        artists_collection.create_index("artist_id", unique=True)
+        playlist_tracks_collection.create_index([("playlist_id", 1), ("song_id", 1)], unique=True)
+        playlist_tracks_collection.create_index([("playlist_id", 1), ("position", 1)])
+        # Let MongoDB expire stale genre lookups on its own
+        artists_collection.create_index("date_cached", expireAfterSeconds=ARTIST_CACHE_DAYS * 24 * 60 * 60)
         logging.info("MongoDB indexes created successfully")
         return True
-    except pymongo.errors.OperationFailure as e:
+    except OperationFailure as e:
         if "authentication" in str(e).lower():
             logging.error("MongoDB authentication required. Please check your credentials in creds_v3.json")
             print("❌ MongoDB requires authentication. Please add credentials to creds_v3.json:")
@@ -68,12 +101,14 @@ def setup_mongodb_indexes():
 
 def test_mongodb_connection():
     """Test MongoDB connection and show database info"""
+    from pymongo.errors import OperationFailure
+
     try:
         # Test connection
-        mongo_client.admin.command('ping')
+        get_client().admin.command('ping')
         print(f"✅ MongoDB connection successful")
-        print(f"Connected to: {mongo_connection_string}")
-        print(f"Database: {mongo_db_name}")
+        print(f"Connected to: {connection_string(redact=True)}")
+        print(f"Database: {database_name()}")
         
         # Show collections
         collections = db.list_collection_names()
@@ -88,7 +123,7 @@ def test_mongodb_connection():
                 print(f"  {collection_name}: (collection doesn't exist yet)")
         
         return True
-    except pymongo.errors.OperationFailure as e:
+    except OperationFailure as e:
         if "authentication" in str(e).lower():
             print(f"❌ MongoDB authentication required")
             print("Please add username/password to creds_v3.json mongodb section")
@@ -97,15 +132,29 @@ def test_mongodb_connection():
         return False
     except Exception as e:
         print(f"❌ MongoDB connection failed: {e}")
-        print(f"Connection string: {mongo_connection_string}")
+        print(f"Connection string: {connection_string(redact=True)}")
         return False
 
-def should_refresh_playlist(playlist_id):
-    """Check if playlist cache should be refreshed"""
-    cached_playlist = playlists_collection.find_one({"playlist_id": playlist_id})
+def should_refresh_playlist(playlist_id, snapshot_id=None):
+    """Check if playlist cache should be refreshed
+    
+    When the current snapshot_id is known it decides on its own: the cache is only stale if the
+    playlist changed. Without one (lookup failed, or an old cache entry) fall back to the age check.
+    """
+    cached_playlist = playlists_collection.find_one(
+        {"playlist_id": playlist_id},
+        {"snapshot_id": 1, "last_updated": 1, "total_songs": 1}
+    )
     
     if not cached_playlist:
         return True
+    
+    # A cache from before playlist_tracks that was never migrated has nothing to serve membership from
+    if cached_playlist.get('total_songs') and not has_cached_tracks(playlist_id):
+        return True
+    
+    if snapshot_id and cached_playlist.get('snapshot_id'):
+        return snapshot_id != cached_playlist['snapshot_id']
         
     last_updated = cached_playlist.get('last_updated')
     if not last_updated:
@@ -119,181 +168,458 @@ def should_refresh_playlist(playlist_id):
     cutoff_date = datetime.now() - timedelta(days=CACHE_REFRESH_DAYS)
     return last_updated < cutoff_date
 
-def get_playlist_songs(playlist_id, playlist_name, access_token, force_refresh=False, limit_songs=None):
-    """Get playlist songs from cache or Spotify API and cache detailed song information"""
+def fetch_playlist_page(playlist_id, playlist_name, offset):
+    """Fetch one page of playlist tracks, returning its items or None on failure"""
+    params = {'offset': offset, 'limit': PAGE_SIZE}
+    try:
+        request = spotify_client.get(
+            f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks", 
+            params=params
+        )
+        response = request.json()
+        
+        # Capture the raw response for debugging (sampled, compressed and written off this thread)
+        response_capture.record('playlist_tracks', response, playlist_id=playlist_id, playlist_name=playlist_name, offset=offset)
+        
+        if 'items' not in response:
+            logging.error(f"Unexpected response format for playlist {playlist_name}: {response}")
+            return None
+        
+        return response['items']
+        
+    except Exception as e:
+        logging.error(f"Error fetching playlist {playlist_name} at offset {offset}: {e}", exc_info=True)
+        return None
+
+def flush_song_writes(song_writes, playlist_name):
+    """Send a page of song upserts as one unordered bulk write, returning the round trips used"""
+    from pymongo.errors import BulkWriteError
+
+    if not song_writes:
+        return 0
     
-    if not force_refresh and not should_refresh_playlist(playlist_id):
-        logging.info(f"Using cached data for playlist: {playlist_name}")
-        cached_playlist = playlists_collection.find_one({"playlist_id": playlist_id})
-        return {
-            'song_ids': cached_playlist['song_ids'],
-            'song_titles': cached_playlist['song_titles']
-        }
+    try:
+        result = songs_collection.bulk_write(song_writes, ordered=False)
+        # Every upserted song is new, and new songs start out unlogged
+        increment_stats(db, total_songs_in_db=result.upserted_count, unlogged_songs=result.upserted_count)
+        return 1
+    except BulkWriteError as e:
+        increment_stats(db, total_songs_in_db=e.details.get('nUpserted', 0), unlogged_songs=e.details.get('nUpserted', 0))
+        # Concurrent refreshes can race on the same new song_id; the document exists now, so retry those as updates
+        duplicate_indexes = [error['index'] for error in e.details.get('writeErrors', []) if error.get('code') == 11000]
+        other_errors = [error for error in e.details.get('writeErrors', []) if error.get('code') != 11000]
+        if other_errors:
+            logging.error(f"Bulk song write for {playlist_name} had {len(other_errors)} errors: {other_errors}")
+        if duplicate_indexes:
+            songs_collection.bulk_write([song_writes[i] for i in duplicate_indexes], ordered=False)
+            return 2
+        return 1
 
-    logging.info(f"Refreshing playlist data for: {playlist_name}")
+def get_page_executor():
+    """The shared page pool, created on first use with PAGE_WORKERS threads"""
+    global _page_executor
+    with _page_executor_lock:
+        if _page_executor is None:
+            _page_executor = ThreadPoolExecutor(max_workers=PAGE_WORKERS, thread_name_prefix='playlist-page')
+        return _page_executor
 
-    # Only fetch the latest playlist name from Spotify when refreshing
-    playlist_name = get_playlist_name_from_spotify(playlist_id, access_token)
+def fetch_playlist_pages(playlist_id, playlist_name, offsets):
+    """Fetch the pages at the given offsets (in parallel when configured), keeping offset order
+    
+    The result stops at the first failed page, so callers only ever see a clean prefix.
+    """
+    # map() keeps offset order even when pages finish out of order
+    if PAGE_WORKERS > 1 and len(offsets) > 1:
+        pages = list(get_page_executor().map(
+            lambda page_offset: fetch_playlist_page(playlist_id, playlist_name, page_offset),
+            offsets
+        ))
+    else:
+        pages = []
+        for page_offset in offsets:
+            pages.append(fetch_playlist_page(playlist_id, playlist_name, page_offset))
+            if pages[-1] is None:
+                break
+    
+    if None in pages:
+        pages = pages[:pages.index(None)]
+    return pages
 
+def cache_page_songs(items, playlist_id, playlist_name, offset, refreshed_at):
+    """Upsert the songs of one page into songs_collection and playlist_tracks and return (song_ids, round_trips)"""
     song_ids = []
-    song_titles = []
-    offset = 0
-    total_songs = return_playlist_length(playlist_id)
+    song_writes = []
+    membership_writes = []
+    
+    for position, song in enumerate(items, start=offset):
+        if song and song.get("track") and song["track"].get("id"):
+            track = song["track"]
+            song_id = track["id"]
+            song_title = track["name"]
+            artist_name = track["artists"][0]["name"] if track["artists"] else "Unknown Artist"
+            song_uri = track["uri"]
+            image_url = track["album"]["images"][0]["url"] if track["album"]["images"] else ""
+
+            song_ids.append(song_id)
+
+            # Cache detailed song information - one upsert per track, flushed per page
+            song_writes.append(pymongo.UpdateOne(
+                {"song_id": song_id},
+                {
+                    "$set": {"date_cached": datetime.now()},
+                    "$addToSet": {"playlists": playlist_id},
+                    "$setOnInsert": {
+                        'uri': song_uri,
+                        'title': song_title,
+                        'artist': artist_name,
+                        'image_url': image_url,
+                        'logged': False  # Only set for new songs
+                    }
+                },
+                upsert=True
+            ))
+            membership_writes.append(pymongo.UpdateOne(
+                {"playlist_id": playlist_id, "song_id": song_id},
+                {"$set": {"position": position, "refreshed_at": refreshed_at}},
+                upsert=True
+            ))
     
-    # If it's the newest playlist, only get the most recent songs
-    if playlist_id == credentials['collections']['yearly_playlist_collection']['playlist_ids'][-1] and limit_songs:
-        total_songs = min(total_songs, limit_songs)
+    round_trips = flush_song_writes(song_writes, playlist_name)
+    if membership_writes:
+        playlist_tracks_collection.bulk_write(membership_writes, ordered=False)
+        round_trips += 1
     
-    while offset < total_songs:
-        params = {'offset': offset, 'limit': 50}
+    return song_ids, round_trips
+
+def read_playlist_window(playlist_id, playlist_name, start, end, refreshed_at):
+    """Read and cache the tracks in [start, end) and return (song_ids, complete, round_trips)"""
+    offsets = list(range(start, end, PAGE_SIZE))
+    pages = fetch_playlist_pages(playlist_id, playlist_name, offsets)
+    return cache_playlist_pages(playlist_id, playlist_name, offsets, pages, refreshed_at)
+
+def cache_playlist_pages(playlist_id, playlist_name, offsets, pages, refreshed_at):
+    """Cache already fetched pages and return (song_ids, complete, round_trips)"""
+    song_ids = []
+    round_trips = 0
+    complete = len(pages) == len(offsets)
+    for offset, items in zip(offsets, pages):
         try:
-            request = requests.get(
-                f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks", 
-                headers={'Authorization': f'Bearer {access_token}'}, 
-                params=params
-            )
-            response = request.json()
-            
-            # Log API response for debugging
-            if not os.path.exists("logs/json"):
-                os.makedirs("logs/json")
-            log_filename = f"logs/json/{datetime.now().strftime('%Y-%m-%d_%H:%M:%S')}_{playlist_name}_offset{offset}.json"
-            with open(log_filename, "w") as file:
-                json.dump(response, file, indent=4)
-            
-            if 'items' not in response:
-                logging.error(f"Unexpected response format for playlist {playlist_name}: {response}")
-                break
-            
-            for song in response['items']:
-                if song and song.get("track") and song["track"].get("id"):
-                    track = song["track"]
-                    song_id = track["id"]
-                    song_title = track["name"]
-                    artist_name = track["artists"][0]["name"] if track["artists"] else "Unknown Artist"
-                    song_uri = track["uri"]
-                    image_url = track["album"]["images"][0]["url"] if track["album"]["images"] else ""
-
-                    song_ids.append(song_id)
-                    song_titles.append(song_title)
-
-                    # Cache detailed song information
-                    existing_song = songs_collection.find_one({"song_id": song_id})
-                    if existing_song:
-                        # Add this playlist to the list if not already there
-                        playlists_list = existing_song.get('playlists', [])
-                        if playlist_id not in playlists_list:
-                            playlists_list.append(playlist_id)
-                        songs_collection.update_one(
-                            {"song_id": song_id},
-                            {"$set": {"playlists": playlists_list, "date_cached": datetime.now()}}
-                        )
-                    else:
-                        song_data = {
-                            'song_id': song_id,
-                            'uri': song_uri,
-                            'title': song_title,
-                            'artist': artist_name,
-                            'image_url': image_url,
-                            'logged': False,  # Only set for new songs
-                            'date_cached': datetime.now(),
-                            'playlists': [playlist_id]
-                        }
-                        songs_collection.insert_one(song_data)
-            
-            offset += 50
-            
+            page_ids, page_round_trips = cache_page_songs(items, playlist_id, playlist_name, offset, refreshed_at)
         except Exception as e:
-            logging.error(f"Error fetching playlist {playlist_name} at offset {offset}: {e}", exc_info=True)
+            logging.error(f"Error caching playlist {playlist_name} at offset {offset}: {e}", exc_info=True)
+            complete = False
             break
+        song_ids.extend(page_ids)
+        round_trips += page_round_trips
+    
+    return song_ids, complete, round_trips
+
+def has_cached_tracks(playlist_id):
+    """Whether playlist_tracks holds any rows for this playlist"""
+    return playlist_tracks_collection.find_one({"playlist_id": playlist_id}, {"_id": 1}) is not None
+
+def get_playlist_memberships(playlist_ids, song_ids):
+    """Return the set of (playlist_id, song_id) pairs that exist, using the unique membership index"""
+    return {
+        (track['playlist_id'], track['song_id'])
+        for track in playlist_tracks_collection.find(
+            {"playlist_id": {"$in": list(playlist_ids)}, "song_id": {"$in": list(song_ids)}},
+            {"_id": 0, "playlist_id": 1, "song_id": 1}
+        )
+    }
+
+def migrate_playlist_tracks(batch_size=1000):
+    """Move song_ids/song_titles arrays from playlist documents into playlist_tracks, one playlist at a time"""
+    migrated_playlists = 0
+    migrated_tracks = 0
+    
+    cursor = playlists_collection.find(
+        {"song_ids": {"$exists": True}},
+        {"playlist_id": 1, "song_ids": 1, "last_updated": 1}
+    ).batch_size(1)
+    for playlist in cursor:
+        playlist_id = playlist['playlist_id']
+        refreshed_at = playlist.get('last_updated') or datetime.now()
+        
+        writes = []
+        for position, song_id in enumerate(playlist.get('song_ids', [])):
+            writes.append(pymongo.UpdateOne(
+                {"playlist_id": playlist_id, "song_id": song_id},
+                {"$setOnInsert": {
+                    "position": position,
+                    "refreshed_at": refreshed_at
+                }},
+                upsert=True
+            ))
+            if len(writes) >= batch_size:
+                playlist_tracks_collection.bulk_write(writes, ordered=False)
+                migrated_tracks += len(writes)
+                writes = []
+        if writes:
+            playlist_tracks_collection.bulk_write(writes, ordered=False)
+            migrated_tracks += len(writes)
+        
+        # Dropping spotify_total makes the next read of the newest playlist a full one, whose
+        # delete_many reconciles any rows the arrays held for tracks removed since
+        playlists_collection.update_one(
+            {"_id": playlist['_id']},
+            {"$unset": {"song_ids": "", "song_titles": "", "spotify_total": ""}}
+        )
+        migrated_playlists += 1
+        logging.info(f"Migrated playlist {playlist_id} to playlist_tracks")
+    
+    logging.info(f"Migrated {migrated_tracks} tracks from {migrated_playlists} playlists to playlist_tracks")
+    return migrated_playlists, migrated_tracks
+
+def migrate_legacy_playlist_caches():
+    """Run migrate_playlist_tracks if any playlist document still holds song_ids, before anything reads membership"""
+    if playlists_collection.find_one({"song_ids": {"$exists": True}}, {"_id": 1}) is None:
+        return
+    logging.info("Found playlist caches from before playlist_tracks, migrating them")
+    migrate_playlist_tracks()
+
+def get_playlist_songs(playlist_id, playlist_name, force_refresh=False, limit_songs=None, snapshot_id=None):
+    """Bring a playlist's cached membership in playlist_tracks and its songs up to date
+    
+    An unchanged snapshot costs nothing beyond the snapshot lookup. With limit_songs and an
+    existing cache, only the last limit_songs tracks (or every track added since the last read, if
+    that is more) are fetched and merged. Use get_playlist_memberships for membership checks.
+    Pass snapshot_id when the caller already looked it up this run.
+    """
+    
+    # One small fields=snapshot_id request tells us whether the playlist changed at all
+    if snapshot_id is None:
+        snapshot_id = get_playlist_snapshot_id(playlist_id)
+    
+    if not force_refresh and not should_refresh_playlist(playlist_id, snapshot_id):
+        logging.info(f"Using cached data for playlist: {playlist_name} (snapshot unchanged)")
+        return
+
+    logging.info(f"Refreshing playlist data for: {playlist_name}")
+
+    # Only fetch the latest playlist name from Spotify when refreshing
+    playlist_name = get_playlist_name_from_spotify(playlist_id)
+    playlist_length = return_playlist_length(playlist_id)
+    
+    refreshed_at = datetime.now()
+    cached_playlist = None
+    if limit_songs and not force_refresh:
+        cached_playlist = playlists_collection.find_one(
+            {"playlist_id": playlist_id},
+            {"spotify_total": 1, "total_songs": 1}
+        )
+    
+    # Tail window: new tracks are appended, so the end of the playlist is all that can have changed.
+    # Fall back to a full read if there is no complete cache, tracks were removed since, or the
+    # tail overlaps the cache at a shifted position (a removal hidden by an append of the same size).
+    previous_length = cached_playlist.get('spotify_total') if cached_playlist else None
+    tail = None
+    if (previous_length is not None and cached_playlist.get('total_songs') and playlist_length >= previous_length
+            and has_cached_tracks(playlist_id)):
+        # Always overlap the cache by at least one track so a shift is visible
+        window = max(limit_songs, playlist_length - previous_length + 1)
+        start = max(0, playlist_length - window)
+        offsets = list(range(start, playlist_length, PAGE_SIZE))
+        pages = fetch_playlist_pages(playlist_id, playlist_name, offsets)
+        if tail_matches_cache(playlist_id, offsets, pages, previous_length):
+            tail = (start, offsets, pages)
+        else:
+            logging.info(f"Tail of {playlist_name} no longer lines up with the cache, reading it in full")
+    
+    if tail:
+        start, offsets, pages = tail
+        tail_ids, complete, round_trips = cache_playlist_pages(
+            playlist_id, playlist_name, offsets, pages, refreshed_at
+        )
+        
+        # The tail was upserted into playlist_tracks, so the count there is the merged membership
+        total_songs = playlist_tracks_collection.count_documents({"playlist_id": playlist_id})
+        update = {
+            'playlist_name': playlist_name,
+            'last_updated': refreshed_at,
+            'total_songs': total_songs
+        }
+        if complete:
+            # A failed tail read keeps the old length, so the next run widens its window to cover the gap
+            update['snapshot_id'] = snapshot_id
+            update['spotify_total'] = playlist_length
+        playlists_collection.update_one({"playlist_id": playlist_id}, {"$set": update})
+        increment_stats(db, total_cached_songs=total_songs - cached_playlist.get('total_songs', 0))
+        
+        logging.info(f"Read last {playlist_length - start} of {playlist_length} tracks of {playlist_name}, {total_songs} songs now cached")
+        full_pages = (playlist_length + PAGE_SIZE - 1) // PAGE_SIZE
+        logging.info(f"Tail read of {playlist_name} fetched {len(offsets)} of {full_pages} pages (saved {full_pages - len(offsets)}) and used {round_trips} bulk writes instead of {len(tail_ids) * 2} round trips (saved {len(tail_ids) * 2 - round_trips})")
+        return
+
+    song_ids, complete, round_trips = read_playlist_window(
+        playlist_id, playlist_name, 0, playlist_length, refreshed_at
+    )
     
-    # Update cache
+    # Drop memberships of tracks that were removed from the playlist - only safe after a full read
+    if complete:
+        removed = playlist_tracks_collection.delete_many({
+            "playlist_id": playlist_id,
+            "refreshed_at": {"$lt": refreshed_at}
+        }).deleted_count
+        if removed:
+            logging.info(f"Removed {removed} tracks no longer in {playlist_name} from playlist_tracks")
+    
+    # Update cache - membership lives in playlist_tracks, this document only holds metadata
     playlist_data = {
         'playlist_id': playlist_id,
         'playlist_name': playlist_name,  # Overwrite with latest name from Spotify only on refresh
-        'song_ids': song_ids,
-        'song_titles': song_titles,
-        'last_updated': datetime.now(),
-        'total_songs': len(song_ids)
+        # Only a complete read may record the snapshot, otherwise a partial cache would look up to date
+        'snapshot_id': snapshot_id if complete else None,
+        'spotify_total': playlist_length if complete else None,
+        'last_updated': refreshed_at,
+        'total_songs': len(set(song_ids))
     }
     
-    playlists_collection.replace_one(
+    previous_playlist = playlists_collection.find_one_and_replace(
         {"playlist_id": playlist_id},
         playlist_data,
+        projection={"total_songs": 1},
         upsert=True
     )
+    increment_stats(
+        db,
+        cached_playlists=0 if previous_playlist else 1,
+        total_cached_songs=playlist_data['total_songs'] - (previous_playlist or {}).get('total_songs', 0)
+    )
     
     logging.info(f"Cached {len(song_ids)} songs for playlist: {playlist_name}")
-    
-    return {
-        'song_ids': song_ids,
-        'song_titles': song_titles
-    }
+    # The old per-track find_one + update_one/insert_one cost two round trips per song
+    logging.info(f"Song cache for {playlist_name} used {round_trips} bulk writes instead of {len(song_ids) * 2} round trips (saved {len(song_ids) * 2 - round_trips})")
 
-def log_add_attempt(song_id, song_name, artist_name, playlist_id, playlist_name, uri):
-    """Log an attempt to add a song to a playlist"""
-    attempt_data = {
+def build_add_attempt(song_id, song_name, artist_name, playlist_id, playlist_name, uri, snapshot_id=None):
+    """Build the add_attempts document for one song/playlist pair"""
+    return {
         'song_id': song_id,
         'song_name': song_name,
         'artist_name': artist_name,
         'playlist_id': playlist_id,
         'playlist_name': playlist_name,
         'uri': uri,
+        'snapshot_id': snapshot_id,
         'attempt_time': datetime.now(),
         'verified': False,
         'verification_attempts': 0
     }
+
+def queue_add(pending_adds, playlist_id, playlist_name, song):
+    """Queue a (song_id, song_name, artist_name, uri) tuple for a batched add to playlist_id"""
+    pending = pending_adds.setdefault(playlist_id, {'name': playlist_name, 'songs': []})
+    pending['songs'].append(song)
+    logging.info(f"Queued '{song[1]}' by {song[2]} for {playlist_name}")
+
+def flush_pending_adds(pending_adds):
+    """Send queued playlist additions in batches and log one add attempt per URI
     
-    add_attempts_collection.insert_one(attempt_data)
-    logging.info(f"Logged add attempt for '{song_name}' by {artist_name} to {playlist_name}")
+    pending_adds maps playlist_id -> {'name': playlist_name, 'songs': [(song_id, song_name, artist_name, uri), ...]}
+    Returns playlist_id -> result dict from add_songs_to_spotify
+    """
+    results = {}
+    for playlist_id, pending in pending_adds.items():
+        if not pending['songs']:
+            continue
+        
+        uris = [song[3] for song in pending['songs']]
+        result = add_songs_to_spotify(uris, playlist_id)
+        results[playlist_id] = result
+        
+        # Only accepted URIs get the snapshot, so verification never skips the fetch for a rejected add
+        added_uris = set(result['added'])
+        attempts = [
+            build_add_attempt(song_id, song_name, artist_name, playlist_id, pending['name'], uri, result['snapshot_id'] if uri in added_uris else None)
+            for song_id, song_name, artist_name, uri in pending['songs']
+        ]
+        add_attempts_collection.insert_many(attempts, ordered=False)
+        increment_stats(db, unverified_attempts=len(attempts))
+        logging.info(f"Logged {len(attempts)} add attempts to {pending['name']} in {(len(uris) + 99) // 100} requests (snapshot {result['snapshot_id']})")
+    
+    return results
 
 def add_song_to_mongodb(uri, title, artist, image_url):
-    """Add song to MongoDB with the required fields format"""
+    """Add song to MongoDB with the required fields format
+    
+    An existing song keeps its logged/downloaded/date_added bookkeeping, so a song that stayed liked
+    after a rejected add is not emailed or downloaded a second time.
+    """
     try:
-        song_data = {
-            'song_id': uri.split(':')[-1],  # Extract ID from URI
-            'uri': uri,
-            'title': title,
-            'artist': artist,
-            'image_url': image_url,
-            'logged': False,  # Set to False - another process will email and mark as logged
-            'downloaded': False,
-            'date_added': datetime.now()
-        }
-        
-        songs_collection.replace_one(
-            {"song_id": song_data['song_id']},
-            song_data,
+        song_id = uri.split(':')[-1]  # Extract ID from URI
+        now = datetime.now()
+        result = songs_collection.update_one(
+            {"song_id": song_id},
+            {
+                "$set": {'uri': uri, 'title': title, 'artist': artist, 'image_url': image_url},
+                "$setOnInsert": {
+                    'logged': False,  # Set to False - another process will email and mark as logged
+                    'downloaded': False,
+                    'date_added': now
+                }
+            },
             upsert=True
         )
         
+        if result.upserted_id is not None:
+            increment_stats(db, total_songs_in_db=1, unlogged_songs=1)
+        else:
+            # Songs first cached from a playlist read have no download bookkeeping yet
+            songs_collection.update_one(
+                {"song_id": song_id, "downloaded": {"$exists": False}},
+                {"$set": {'downloaded': False, 'date_added': now}}
+            )
+        
         logging.info(f"Added song '{title}' by {artist} to MongoDB")
         
     except Exception as e:
         logging.error(f"Error adding song to MongoDB: {e}", exc_info=True)
 
-def verify_song_additions(access_token):
-    """Verify that songs were actually added to playlists"""
-    unverified_attempts = add_attempts_collection.find({
-        "verified": False,
-        "verification_attempts": {"$lt": 3},
-        "attempt_time": {"$gt": datetime.now() - timedelta(hours=24)}
-    })
+def verify_song_additions():
+    """Verify that songs were actually added to playlists, reading each playlist at most once per pass"""
+    migrate_legacy_playlist_caches()
+    unverified_attempts = add_attempts_collection.find(
+        {
+            "verified": False,
+            "verification_attempts": {"$lt": 3},
+            "attempt_time": {"$gt": datetime.now() - timedelta(hours=24)}
+        },
+        {"song_id": 1, "song_name": 1, "artist_name": 1, "playlist_id": 1, "playlist_name": 1, "uri": 1, "snapshot_id": 1, "verification_attempts": 1}
+    )
     
+    attempts_by_playlist = {}
     for attempt in unverified_attempts:
+        attempts_by_playlist.setdefault(attempt['playlist_id'], []).append(attempt)
+    
+    for playlist_id, attempts in attempts_by_playlist.items():
         try:
-            # Check if song is now in the playlist
-            playlist_data = get_playlist_songs(
-                attempt['playlist_id'], 
-                attempt['playlist_name'], 
-                access_token,
-                force_refresh=True
-            )
+            playlist_name = attempts[0]['playlist_name']
+            current_snapshot = get_playlist_snapshot_id(playlist_id)
             
-            if attempt['song_id'] in playlist_data['song_ids']:
-                # Song was successfully added
-                add_attempts_collection.update_one(
-                    {"_id": attempt["_id"]},
+            # If the playlist is still at the snapshot our add produced, the song is there - no fetch needed
+            verified = [a for a in attempts if current_snapshot and a.get('snapshot_id') == current_snapshot]
+            pending = [a for a in attempts if not (current_snapshot and a.get('snapshot_id') == current_snapshot)]
+            
+            missing = []
+            if pending:
+                # Added tracks are appended, so a tail read (widened to everything added since the last read) covers them.
+                # If collect already cached current_snapshot this run, this is a no-op and membership is read as is.
+                get_playlist_songs(
+                    playlist_id,
+                    playlist_name,
+                    limit_songs=NEWEST_PLAYLIST_CHECK_SONGS,
+                    snapshot_id=current_snapshot
+                )
+                memberships = get_playlist_memberships([playlist_id], [a['song_id'] for a in pending])
+                for attempt in pending:
+                    if (playlist_id, attempt['song_id']) in memberships:
+                        verified.append(attempt)
+                    else:
+                        missing.append(attempt)
+            
+            if verified:
+                result = add_attempts_collection.update_many(
+                    {"_id": {"$in": [a['_id'] for a in verified]}},
                     {
                         "$set": {
                             "verified": True,
@@ -301,62 +627,65 @@ def verify_song_additions(access_token):
                         }
                     }
                 )
-                logging.info(f"Verified: '{attempt['song_name']}' was successfully added to {attempt['playlist_name']}")
-            else:
-                # Song wasn't found, increment verification attempts
-                add_attempts_collection.update_one(
-                    {"_id": attempt["_id"]},
+                increment_stats(db, unverified_attempts=-result.modified_count)
+                logging.info(f"Verified {len(verified)} songs were successfully added to {playlist_name}")
+            
+            if missing:
+                # Songs weren't found, increment verification attempts
+                add_attempts_collection.update_many(
+                    {"_id": {"$in": [a['_id'] for a in missing]}},
                     {
                         "$inc": {"verification_attempts": 1}
                     }
                 )
-                logging.warning(f"Song '{attempt['song_name']}' not found in {attempt['playlist_name']} - attempt {attempt['verification_attempts'] + 1}")
+                # Attempts reaching 3 verification attempts move from unverified to failed
+                newly_failed = sum(1 for a in missing if a['verification_attempts'] == 2)
+                increment_stats(db, unverified_attempts=-newly_failed, failed_attempts=newly_failed)
+                for attempt in missing:
+                    logging.warning(f"Song '{attempt['song_name']}' not found in {playlist_name} - attempt {attempt['verification_attempts'] + 1}")
                 
-                # Try to re-add the song if it's still missing
-                if attempt['verification_attempts'] < 2:
-                    logging.info(f"Re-attempting to add '{attempt['song_name']}' to {attempt['playlist_name']}")
-                    add_song_to_spotify(
-                        attempt['uri'], 
-                        attempt['playlist_id'], 
-                        attempt['song_name'], 
-                        attempt['artist_name']
-                    )
+                # Try to re-add the songs that are still missing, in one batched request
+                retry = [a for a in missing if a['verification_attempts'] < 2]
+                if retry:
+                    logging.info(f"Re-attempting to add {len(retry)} songs to {playlist_name}")
+                    result = add_songs_to_spotify([a['uri'] for a in retry], playlist_id)
+                    added_uris = set(result['added'])
+                    readded_ids = [a['_id'] for a in retry if a['uri'] in added_uris]
+                    if readded_ids and result['snapshot_id']:
+                        add_attempts_collection.update_many(
+                            {"_id": {"$in": readded_ids}},
+                            {"$set": {"snapshot_id": result['snapshot_id']}}
+                        )
                     
         except Exception as e:
-            logging.error(f"Error verifying song addition: {e}", exc_info=True)
+            logging.error(f"Error verifying song additions for playlist {playlist_id}: {e}", exc_info=True)
 
-def get_all_playlist_data(access_token):
+def get_all_playlist_data():
     """Get data for all playlists (cached or fresh) - checks ALL playlists from credentials"""
     playlist_info = {}
     
     # Add current yearly playlist
     current_yearly_id = credentials['collections']['yearly_playlist_collection']['playlist_ids'][-1]
-    current_yearly_name = get_playlist_name_from_spotify(current_yearly_id, access_token)
+    current_yearly_name = get_playlist_name_from_spotify(current_yearly_id)
     playlist_info['current_yearly'] = {
         'id': current_yearly_id,
-        'name': current_yearly_name,
-        'song_ids': [],
-        'song_titles': []
+        'name': current_yearly_name
     }
     
     # Add country playlist
     country_id = credentials['country_collection_id']
-    country_name = get_playlist_name_from_spotify(country_id, access_token)
+    country_name = get_playlist_name_from_spotify(country_id)
     playlist_info['country_playlist'] = {
         'id': country_id,
-        'name': country_name,
-        'song_ids': [],
-        'song_titles': []
+        'name': country_name
     }
     
     # Add main collection playlist
     collection_id = credentials['collections']['yearly_playlist_collection']['destination_id']
-    collection_name = get_playlist_name_from_spotify(collection_id, access_token)
+    collection_name = get_playlist_name_from_spotify(collection_id)
     playlist_info['collection_playlist'] = {
         'id': collection_id,
-        'name': collection_name,
-        'song_ids': [],
-        'song_titles': []
+        'name': collection_name
     }
     
     # Add ALL yearly playlists from the credentials file
@@ -367,49 +696,140 @@ def get_all_playlist_data(access_token):
         if cached_playlist and 'playlist_name' in cached_playlist:
             playlist_name = cached_playlist['playlist_name']
         else:
-            playlist_name = get_playlist_name_from_spotify(playlist_id, access_token)
+            playlist_name = get_playlist_name_from_spotify(playlist_id)
             # Cache the playlist name for future use
-            playlists_collection.update_one(
+            result = playlists_collection.update_one(
             {"playlist_id": playlist_id},
             {"$set": {"playlist_name": playlist_name}},
             upsert=True
             )
+            if result.upserted_id is not None:
+                increment_stats(db, cached_playlists=1)
         key = f'yearly_playlist_{i}'
         playlist_info[key] = {
             'id': playlist_id,
-            'name': playlist_name,
-            'song_ids': [],
-            'song_titles': []
+            'name': playlist_name
         }
     logging.info(f"Processing {len(playlist_info)} playlists total")
     
-    # Get playlist data (cached or fresh)
-    for playlist_key, playlist_data in playlist_info.items():
-        # Only limit songs for the current yearly playlist
-        limit_songs = NEWEST_PLAYLIST_CHECK_SONGS if playlist_key == 'current_yearly' else None
+    # Get playlist data (cached or fresh) - each distinct playlist is read once even if it has several keys
+    newest_id = playlist_info['current_yearly']['id']
+    playlist_names = {}
+    for playlist_data in playlist_info.values():
+        playlist_names.setdefault(playlist_data['id'], playlist_data['name'])
+    
+    def refresh_one(playlist_id):
+        # Only the newest yearly playlist is read as a tail window
+        limit_songs = NEWEST_PLAYLIST_CHECK_SONGS if playlist_id == newest_id else None
         
-        logging.info(f"Processing playlist: {playlist_data['name']} (ID: {playlist_data['id']})")
+        logging.info(f"Processing playlist: {playlist_names[playlist_id]} (ID: {playlist_id})")
         
-        songs_data = get_playlist_songs(
-            playlist_data['id'],
-            playlist_data['name'],
-            access_token,
+        get_playlist_songs(
+            playlist_id,
+            playlist_names[playlist_id],
             limit_songs=limit_songs
         )
-        
-        playlist_info[playlist_key]['song_ids'] = songs_data['song_ids']
-        playlist_info[playlist_key]['song_titles'] = songs_data['song_titles']
     
+    playlist_ids = list(playlist_names.keys())
+    if PLAYLIST_WORKERS > 1:
+        with ThreadPoolExecutor(max_workers=PLAYLIST_WORKERS) as executor:
+            # list() waits for every refresh and re-raises the first error
+            list(executor.map(refresh_one, playlist_ids))
+    else:
+        for playlist_id in playlist_ids:
+            refresh_one(playlist_id)
+    
+    # Membership is answered from playlist_tracks via get_playlist_memberships
     return playlist_info
 
-def process_liked_tracks(playlist_info, access_token):
-    """Process all liked tracks and add them to appropriate playlists"""
-    liked_tracks = get_liked_tracks()['items']
+def get_artist_genres(artist_ids):
+    """Return artist_id -> {'name', 'genres'}, using the artists cache and batching any misses"""
+    artist_ids = list(dict.fromkeys(artist_ids))
+    # date_cached drives a TTL index, and MongoDB expires documents by UTC
+    cutoff_date = datetime.now(timezone.utc) - timedelta(days=ARTIST_CACHE_DAYS)
+    
+    artists = {}
+    for artist in artists_collection.find(
+        {"artist_id": {"$in": artist_ids}, "date_cached": {"$gt": cutoff_date}},
+        {"_id": 0, "artist_id": 1, "name": 1, "genres": 1}
+    ):
+        artists[artist['artist_id']] = {'name': artist['name'], 'genres': artist['genres']}
+    
+    missing_ids = [artist_id for artist_id in artist_ids if artist_id not in artists]
+    if missing_ids:
+        artist_writes = []
+        for artist in get_artists(missing_ids):
+            artists[artist['id']] = {'name': artist['name'], 'genres': artist.get('genres', [])}
+            artist_writes.append(pymongo.UpdateOne(
+                {"artist_id": artist['id']},
+                {"$set": {"name": artist['name'], "genres": artist.get('genres', []), "date_cached": datetime.now(timezone.utc)}},
+                upsert=True
+            ))
+        if artist_writes:
+            artists_collection.bulk_write(artist_writes, ordered=False)
+    
+    logging.info(f"Resolved {len(artist_ids)} artists: {len(artist_ids) - len(missing_ids)} from cache, {len(missing_ids)} via {(len(missing_ids) + 49) // 50} API calls")
+    return artists
+
+def unlike_songs_with_accepted_adds(processed_songs, pending_adds, add_results):
+    """Unlike processed songs in batches of 50, keeping any song with a rejected add liked for the next run"""
+    rejected = set()
+    for playlist_id, pending in pending_adds.items():
+        added_uris = set(add_results.get(playlist_id, {}).get('added', []))
+        for song_id, song_name, artist_name, uri in pending['songs']:
+            if uri not in added_uris:
+                rejected.add(song_id)
+                logging.warning(f"Keeping '{song_name}' by {artist_name} liked - add to {pending['name']} was not accepted")
+    
+    song_ids = [song[0] for song in processed_songs if song[0] not in rejected]
+    if not song_ids:
+        return {'removed': [], 'failed': []}
+    
+    result = delete_songs_from_likes(song_ids)
+    for song_id in result['failed']:
+        logging.warning(f"Failed to unlike {song_id} - it will be picked up again next run")
+    logging.info(f"Unliked {len(result['removed'])} of {len(song_ids)} songs in {(len(song_ids) + 49) // 50} requests")
+    return result
+
+def process_liked_tracks(playlist_info):
+    """Process all liked tracks and add them to appropriate playlists, one batch at a time"""
+    batch_count = 0
+    track_count = 0
+    
+    # The next page is fetched in the background while the current batch is routed, added, unliked and stored
+    for liked_tracks in iter_liked_tracks(LIKED_TRACKS_BATCH_SIZE):
+        batch_count += 1
+        track_count += len(liked_tracks)
+        process_liked_batch(liked_tracks, playlist_info)
+    
+    logging.info(f"Processed {track_count} liked tracks in {batch_count} batches")
+
+def process_liked_batch(liked_tracks, playlist_info):
+    """Route one batch of liked tracks to their playlists, then unlike the ones that were added"""
+    pending_adds = {}
+    processed_songs = []
+    
+    # One indexed lookup tells us which songs of this batch are already in the target playlists
+    target_ids = [
+        playlist_info['country_playlist']['id'],
+        playlist_info['current_yearly']['id'],
+        playlist_info['collection_playlist']['id']
+    ]
+    memberships = get_playlist_memberships(target_ids, [
+        track['track']['id'] for track in liked_tracks if track.get('track') and track['track'].get('id')
+    ])
+    
+    # Resolve genres for the whole batch up front from the artists cache
+    artist_genres = get_artist_genres([
+        track['track']['artists'][0]['id']
+        for track in liked_tracks
+        if track.get('track') and track['track'].get('artists')
+    ])
     
     for track in liked_tracks:
         try:
             primary_artist = track['track']['artists'][0]['id']
-            artist_info = get_artist(primary_artist)
+            artist_info = artist_genres.get(primary_artist) or get_artist(primary_artist)
             
             # Check if country music
             country = any('country' in genre.lower() for genre in artist_info['genres'])
@@ -422,154 +842,196 @@ def process_liked_tracks(playlist_info, access_token):
             song_uri = track["track"]["uri"]
             image_url = track["track"]["album"]["images"][0]["url"] if track["track"]["album"]["images"] else ""
             
+            song = (song_id, song_name, artist_name, song_uri)
+            
             if country:
-                # Add to country playlist if not already there
-                if song_id not in playlist_info['country_playlist']['song_ids']:
-                    add_song_to_spotify(
-                        song_uri, 
-                        credentials['country_collection_id'], 
-                        song_name, 
-                        artist_name
-                    )
-                    
-                    # Log the attempt
-                    log_add_attempt(
-                        song_id, song_name, artist_name,
-                        credentials['country_collection_id'],
-                        playlist_info['country_playlist']['name'],
-                        song_uri
-                    )
+                # Queue for the country playlist if not already there
+                if (playlist_info['country_playlist']['id'], song_id) not in memberships:
+                    queue_add(pending_adds, credentials['country_collection_id'], playlist_info['country_playlist']['name'], song)
                 else:
                     logging.info(f"Not adding '{song_name}' by {artist_name} - already in country playlist")
             
             else:
-                # Add to current yearly playlist if not already there
-                if song_id not in playlist_info['current_yearly']['song_ids']:
-                    add_song_to_spotify(
-                        song_uri,
-                        playlist_info['current_yearly']['id'],
-                        song_name,
-                        artist_name
-                    )
-                    
-                    # Log the attempt
-                    log_add_attempt(
-                        song_id, song_name, artist_name,
-                        playlist_info['current_yearly']['id'],
-                        playlist_info['current_yearly']['name'],
-                        song_uri
-                    )
+                # Queue for the current yearly playlist if not already there
+                if (playlist_info['current_yearly']['id'], song_id) not in memberships:
+                    queue_add(pending_adds, playlist_info['current_yearly']['id'], playlist_info['current_yearly']['name'], song)
                 else:
                     logging.info(f"Not adding '{song_name}' by {artist_name} - already in current yearly playlist")
                 
-                # Add to main collection if not already there
-                if song_id not in playlist_info['collection_playlist']['song_ids']:
-                    add_song_to_spotify(
-                        song_uri,
-                        playlist_info['collection_playlist']['id'],
-                        song_name,
-                        artist_name
-                    )
-                    
-                    # Log the attempt
-                    log_add_attempt(
-                        song_id, song_name, artist_name,
-                        playlist_info['collection_playlist']['id'],
-                        playlist_info['collection_playlist']['name'],
-                        song_uri
-                    )
+                # Queue for the main collection if not already there
+                if (playlist_info['collection_playlist']['id'], song_id) not in memberships:
+                    queue_add(pending_adds, playlist_info['collection_playlist']['id'], playlist_info['collection_playlist']['name'], song)
                 else:
                     logging.info(f"Not adding '{song_name}' by {artist_name} - already in main collection")
             
-            # Remove from likes and add to MongoDB instead of Firestore
-            delete_song_from_likes(song_id)
+            # Unliked in one batch once the queued adds are accepted; add to MongoDB instead of Firestore
+            processed_songs.append(song)
             add_song_to_mongodb(song_uri, song_name, artist_name, image_url)
             
         except Exception as e:
             logging.error(f"Error processing track {track.get('track', {}).get('name', 'Unknown')}: {e}", exc_info=True)
+    
+    # Send all queued additions, up to 100 URIs per request per playlist
+    add_results = flush_pending_adds(pending_adds)
+    
+    # Remove from likes only the songs whose playlist adds were all accepted
+    unlike_songs_with_accepted_adds(processed_songs, pending_adds, add_results)
 
-def get_statistics():
-    """Get statistics about cached data and recent activity"""
-    stats = {
-        'cached_playlists': playlists_collection.count_documents({}),
-        'total_cached_songs': sum([p.get('total_songs', 0) for p in playlists_collection.find({})]),
-        'total_songs_in_db': songs_collection.count_documents({}),
-        'logged_songs': songs_collection.count_documents({"logged": True}),
-        'unlogged_songs': songs_collection.count_documents({"logged": False}),
-        'recent_add_attempts': add_attempts_collection.count_documents({
-            'attempt_time': {'$gt': datetime.now() - timedelta(days=7)}
-        }),
-        'recently_cached_songs': songs_collection.count_documents({
-            'date_cached': {'$gt': datetime.now() - timedelta(days=7)}
-        }),
-        'unverified_attempts': add_attempts_collection.count_documents({
-            'verified': False,
-            'verification_attempts': {'$lt': 3}
-        }),
-        'failed_attempts': add_attempts_collection.count_documents({
-            'verified': False,
-            'verification_attempts': {'$gte': 3}
-        })
-    }
+def get_statistics(exact=False):
+    """Get statistics about cached data and recent activity
+    
+    Reads the incrementally maintained stats document when it exists (constant time) and adds
+    the 7-day windows from two indexed counts. With exact=True, or before the document has been
+    built, everything is computed with one aggregation and the document is rebuilt from the result.
+    """
+    stats = None if exact else read_stats(db)
+    if stats is None:
+        stats = rebuild_stats(db)
+    else:
+        stats.update(count_recent_activity(db))
     
     logging.info(f"MongoDB Statistics: {stats}")
     return stats
 
-def collect_playlists_v3():
+def collect_playlists_v3(setup_indexes=True):
     """Main collection function with MongoDB caching and verification"""
-    # Setup MongoDB
-    setup_mongodb_indexes()
-    # Get access token
-    access_token = refresh_token()
+    # Setup MongoDB (the daemon does this once at start-up instead)
+    if setup_indexes:
+        setup_mongodb_indexes()
+    migrate_legacy_playlist_caches()
+    # Get access token up front so bad credentials fail before any work
+    refresh_token()
     # Show current statistics
     get_statistics()
     # Get all playlist data
-    playlist_info = get_all_playlist_data(access_token)
+    playlist_info = get_all_playlist_data()
     # Process liked tracks
-    process_liked_tracks(playlist_info, access_token)
+    process_liked_tracks(playlist_info)
     # Show final statistics
     get_statistics()
 
-def log_cleaner():
-    """Clean up large log files"""
-    directory = "logs/json"
-    if os.path.exists(directory):
-        for file in os.listdir(directory):
-            file_path = f'{directory}/{file}'
-            try:
-                file_size = os.stat(file_path)
-                if file_size.st_size >= 5_000:
-                    logging.info(f"Removing {file_path} because it is over 5KB at {file_size.st_size} bytes")
-                    os.remove(file_path)
-            except Exception as e:
-                logging.error(f"Error cleaning up {file_path}: {e}")
+def clean_logs(background=False, dry_run=False):
+    """Apply the log retention policies (age, size budget, compression) to logs/"""
+    policies = load_policies(credentials.get('retention', {}))
+    if background:
+        # Runs after the collection itself is done; the process exits once the thread finishes
+        return run_retention_in_background(policies)
+    return run_retention(policies, dry_run=dry_run)
 
-def get_recently_logged_songs(days=7):
+def run_daemon(job_names=None):
+    """Run collect, verify, summary, download and log retention on their intervals until SIGTERM
+    
+    One process keeps the Mongo client, the Spotify session and token, and the music library
+    index warm between runs instead of rebuilding them from every cron invocation.
+    """
+    import summary_v3, download_v3
+    from daemon_v3 import Daemon, load_job_config
+    from mongo_v3 import close_client
+    
+    download_v3.configure()
+    setup_mongodb_indexes()
+    
+    runners = {
+        'collect': lambda: collect_playlists_v3(setup_indexes=False),
+        'verify': verify_song_additions,
+        'summary': summary_v3.daily_summary,
+        'download': download_v3.daily_download,
+        'clean-logs': clean_logs
+    }
+    
+    daemon_config = credentials.get('daemon', {})
+    daemon = Daemon(tick_seconds=daemon_config.get('tick_seconds', 5))
+    for name, job_config in load_job_config(daemon_config).items():
+        if (job_names and name not in job_names) or not job_config.get('enabled', True):
+            continue
+        daemon.add_job(
+            name,
+            runners[name],
+            interval_minutes=job_config['interval_minutes'],
+            jitter_minutes=job_config.get('jitter_minutes', 0),
+            run_on_start=job_config.get('run_on_start', True)
+        )
+    
+    if not daemon.jobs:
+        print("❌ No daemon jobs enabled")
+        return
+    
+    daemon.install_signal_handlers()
+    print(f"😈 Daemon running jobs: {', '.join(daemon.jobs)} (pid {os.getpid()})")
+    try:
+        # Start a new dated log file at midnight, like a fresh cron run would; refresh the metrics textfile every interval
+        daemon.run(on_new_day=configure_logging, on_tick=metrics.export_if_due)
+    finally:
+        response_capture.close()
+        close_client()
+        metrics.export()
+    print(f"✅ Daemon stopped: {daemon.summary()}")
+
+def encode_recent_songs_cursor(song):
+    """Build the --after token for the page that follows this song"""
+    date_added = song.get('date_added')
+    return f"{date_added.isoformat() if date_added else ''}|{song['_id']}"
+
+def iter_recent_songs(days=7, limit=None, after=None):
+    """Stream unlogged recent songs newest first, projected to the fields callers use
+    
+    Results are ordered by (date_added, _id) descending; pass the cursor of the last row seen as
+    after to continue from there. Songs without date_added sort last.
+    """
+    from bson import ObjectId
+
+    cutoff_date = datetime.now() - timedelta(days=days)
+    
+    query = {
+        "$or": [
+            {"date_added": {"$gt": cutoff_date}},
+            {"date_cached": {"$gt": cutoff_date}}
+        ],
+        "logged": False  # Only get songs that haven't been emailed yet
+    }
+    
+    if after:
+        after_date, after_id = after.split('|', 1)
+        after_id = ObjectId(after_id)
+        if after_date:
+            after_date = datetime.fromisoformat(after_date)
+            position = {"$or": [
+                {"date_added": {"$lt": after_date}},
+                {"date_added": after_date, "_id": {"$lt": after_id}},
+                {"date_added": None}
+            ]}
+        else:
+            position = {"date_added": None, "_id": {"$lt": after_id}}
+        query = {"$and": [query, position]}
+    
+    cursor = songs_collection.find(query, {
+        'artist': 1,
+        'title': 1,
+        'uri': 1,
+        'image_url': 1,
+        'logged': 1,
+        'date_added': 1,
+        'playlists': 1
+    }).sort([("date_added", -1), ("_id", -1)])
+    if limit:
+        cursor = cursor.limit(limit)
+    
+    for song in cursor:
+        yield {
+            'artist': song.get('artist', 'Unknown Artist'),
+            'title': song.get('title', 'Unknown Title'),
+            'uri': song.get('uri', ''),
+            'image_url': song.get('image_url', ''),
+            'logged': song.get('logged', False),
+            'date_added': song.get('date_added'),
+            'playlists': song.get('playlists', []),
+            'cursor': encode_recent_songs_cursor(song)
+        }
+
+def get_recently_logged_songs(days=7, limit=None, after=None):
     """Get songs that were logged recently for email updates"""
     try:
-        cutoff_date = datetime.now() - timedelta(days=days)
-        
-        # Find songs that are unlogged (ready for email updates)
-        recent_songs = songs_collection.find({
-            "$or": [
-                {"date_added": {"$gt": cutoff_date}},
-                {"date_cached": {"$gt": cutoff_date}}
-            ],
-            "logged": False  # Only get songs that haven't been emailed yet
-        }).sort("date_added", -1)
-        
-        songs_list = []
-        for song in recent_songs:
-            songs_list.append({
-                'artist': song.get('artist', 'Unknown Artist'),
-                'title': song.get('title', 'Unknown Title'),
-                'uri': song.get('uri', ''),
-                'image_url': song.get('image_url', ''),
-                'logged': song.get('logged', False),
-                'date_added': song.get('date_added'),
-                'playlists': song.get('playlists', [])
-            })
-        
+        songs_list = list(iter_recent_songs(days, limit, after))
         logging.info(f"Found {len(songs_list)} recently logged songs")
         return songs_list
         
@@ -577,12 +1039,11 @@ def get_recently_logged_songs(days=7):
         logging.error(f"Error getting recently logged songs: {e}", exc_info=True)
         return []
 
-def get_playlist_name_from_spotify(playlist_id, access_token):
+def get_playlist_name_from_spotify(playlist_id):
     """Get the actual playlist name from Spotify API"""
     try:
-        request = requests.get(
+        request = spotify_client.get(
             f"https://api.spotify.com/v1/playlists/{playlist_id}",
-            headers={'Authorization': f'Bearer {access_token}'},
             params={'fields': 'name'}
         )
         response = request.json()
@@ -597,6 +1058,23 @@ def get_playlist_name_from_spotify(playlist_id, access_token):
         logging.error(f"Error getting playlist name for {playlist_id}: {e}")
         return f"Playlist {playlist_id}"
 
+def get_playlist_snapshot_id(playlist_id):
+    """Get the playlist's current snapshot_id from Spotify, or None if it can't be read"""
+    try:
+        response = spotify_client.get(
+            f"https://api.spotify.com/v1/playlists/{playlist_id}",
+            params={'fields': 'snapshot_id'}
+        ).json()
+        
+        if 'snapshot_id' in response:
+            return response['snapshot_id']
+        logging.warning(f"Could not get snapshot_id for playlist {playlist_id}: {response}")
+        return None
+        
+    except Exception as e:
+        logging.error(f"Error getting snapshot_id for {playlist_id}: {e}")
+        return None
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Spotify Collector V3 - Function-oriented MongoDB version')
     
@@ -608,6 +1086,7 @@ if __name__ == "__main__":
     
     # Statistics command
     stats_parser = subparsers.add_parser('stats', help='Show MongoDB statistics')
+    stats_parser.add_argument('--exact', action='store_true', help='Recompute with a full aggregation and rebuild the stats document')
     
     # Test MongoDB connection
     test_parser = subparsers.add_parser('test-db', help='Test MongoDB connection')
@@ -616,41 +1095,79 @@ if __name__ == "__main__":
     setup_parser = subparsers.add_parser('setup-db', help='Setup MongoDB indexes')
     
     # Clean logs
-    clean_parser = subparsers.add_parser('clean-logs', help='Clean up large log files')
+    clean_parser = subparsers.add_parser('clean-logs', help='Apply log retention (rotate, compress and prune logs/)')
+    clean_parser.add_argument('--dry-run', action='store_true', help='Only report what would be rotated, compressed or removed')
     
     # Get recent songs for email updates
     recent_parser = subparsers.add_parser('recent-songs', help='Get recently logged songs for email updates')
     recent_parser.add_argument('--days', type=int, default=7, help='Number of days to look back (default: 7)')
+    recent_parser.add_argument('--limit', type=int, default=None, help='Maximum number of songs to show')
+    recent_parser.add_argument('--after', default=None, help='Continue after this cursor (printed at the end of the previous page)')
+    recent_parser.add_argument('--json', action='store_true', help='Stream one JSON object per line instead of the readable list')
+    
+    # Move playlist song arrays into the playlist_tracks collection
+    migrate_parser = subparsers.add_parser('migrate-playlist-tracks', help='Move cached playlist song arrays into playlist_tracks')
     
     # Verify song additions
     verify_parser = subparsers.add_parser('verify', help='Run song addition verification')
     
+    # Long-running replacement for the cron entries
+    daemon_parser = subparsers.add_parser('daemon', help='Run collect, verify, summary, download and clean-logs on intervals until SIGTERM')
+    daemon_parser.add_argument('--jobs', nargs='+', choices=['collect', 'verify', 'summary', 'download', 'clean-logs'], help='Only run these jobs (default: all enabled jobs)')
+    
     # Parse arguments
     args = parser.parse_args()
     
+    # Nothing is read or configured at import time, so --help never touches creds_v3.json or logs/
+    initialize()
+    configure(metrics_source=args.command or 'collect')
+    command_started = time.monotonic()
+    command_succeeded = False
+    # A run skipped for a held lock records nothing, so the textfile keeps the real last run
+    lock_skipped = False
+    
     # If no command provided, run main collection (backward compatibility)
     if not args.command:
-        try:
-            collect_playlists_v3()
-        except Exception as err:
-            logging.error(f"Error in main collection process: {err}", exc_info=True)
-            print(f"❌ Error: {err}")
-        finally:
-            log_cleaner()
+        with job_lock('collect') as acquired:
+            if not acquired:
+                print("⏭️  Collection is already running (cron or daemon), skipping")
+                sys.exit(0)
+            try:
+                collect_playlists_v3()
+                command_succeeded = True
+            except Exception as err:
+                logging.error(f"Error in main collection process: {err}", exc_info=True)
+                print(f"❌ Error: {err}")
+            finally:
+                clean_logs(background=True)
+                metrics.record_run('collect', command_succeeded, time.monotonic() - command_started)
+                metrics.export()
         sys.exit(0)
     
     try:
         if args.command == 'collect':
-            print("🚀 Starting main collection process...")
-            collect_playlists_v3()
+            with job_lock('collect') as acquired:
+                if not acquired:
+                    lock_skipped = True
+                    print("⏭️  Collection is already running (cron or daemon), skipping")
+                else:
+                    print("🚀 Starting main collection process...")
+                    collect_playlists_v3()
+                    clean_logs(background=True)
         elif args.command == 'verify':
-            print("🔍 Running song addition verification...")
-            access_token = refresh_token()
-            verify_song_additions(access_token)
+            with job_lock('verify') as acquired:
+                if not acquired:
+                    lock_skipped = True
+                    print("⏭️  Verification is already running (cron or daemon), skipping")
+                else:
+                    print("🔍 Running song addition verification...")
+                    verify_song_additions()
+        elif args.command == 'daemon':
+            run_daemon(args.jobs)
         elif args.command == 'stats':
             print("📊 MongoDB Statistics:")
             try:
-                stats = get_statistics()
+                stats = get_statistics(exact=args.exact)
                 print("\nDetailed breakdown:")
                 for key, value in stats.items():
                     print(f"  {key.replace('_', ' ').title()}: {value}")
@@ -667,30 +1184,56 @@ if __name__ == "__main__":
             else:
                 print("❌ Failed to create MongoDB indexes")
             
+        elif args.command == 'migrate-playlist-tracks':
+            print("🚚 Migrating cached playlists to playlist_tracks...")
+            setup_mongodb_indexes()
+            migrated_playlists, migrated_tracks = migrate_playlist_tracks()
+            print(f"✅ Migrated {migrated_tracks} tracks from {migrated_playlists} playlists")
+            
         elif args.command == 'clean-logs':
             print("🧹 Cleaning log files...")
-            log_cleaner()
+            for directory, summary in clean_logs(dry_run=args.dry_run).items():
+                print(f"  {directory}: {summary}")
             print("✅ Log cleanup complete")
             
         elif args.command == 'recent-songs':
-            print(f"📧 Getting recently logged songs (last {args.days} days)...")
-            try:
-                recent_songs = get_recently_logged_songs(args.days)
-                if recent_songs:
-                    print(f"\nFound {len(recent_songs)} recently logged songs:")
-                    for song in recent_songs:
+            if args.json:
+                # Stream rows as they come off the cursor; nothing is collected in memory
+                for song in iter_recent_songs(args.days, args.limit, args.after):
+                    song['date_added'] = song['date_added'].isoformat() if song['date_added'] else None
+                    print(json.dumps(song))
+            else:
+                print(f"📧 Getting recently logged songs (last {args.days} days)...")
+                try:
+                    song_count = 0
+                    last_cursor = None
+                    for song in iter_recent_songs(args.days, args.limit, args.after):
+                        if song_count == 0:
+                            print()
+                        song_count += 1
+                        last_cursor = song['cursor']
                         print(f"  • {song['title']} by {song['artist']}")
                         print(f"    URI: {song['uri']}")
                         print(f"    Logged: {song['logged']}")
-                        if song.get('playlists'):
+                        if song['playlists']:
                             print(f"    In playlists: {len(song['playlists'])}")
                         print()
-                else:
-                    print("No recently logged songs found.")
-            except Exception as e:
-                print(f"❌ Could not get recent songs: {e}")
+                    if song_count:
+                        print(f"Found {song_count} recently logged songs")
+                        if args.limit and song_count == args.limit:
+                            print(f"Next page: --after '{last_cursor}'")
+                    else:
+                        print("No recently logged songs found.")
+                except Exception as e:
+                    print(f"❌ Could not get recent songs: {e}")
             
+        command_succeeded = True
     except Exception as err:
         logging.error(f"Error running command '{args.command}': {err}", exc_info=True)
         print(f"❌ Error: {err}")
         sys.exit(1)
+    finally:
+        # The daemon records its own jobs and exports as it goes
+        if args.command != 'daemon' and not lock_skipped:
+            metrics.record_run(args.command, command_succeeded, time.monotonic() - command_started)
+            metrics.export()
@@ -0,0 +1,142 @@
+import datetime, fcntl, logging, os, random, signal, threading, time
+from contextlib import contextmanager
+from metrics_v3 import metrics
+
+# Intervals for the jobs that used to be separate cron entries; override per job in the
+# optional 'daemon' section of creds_v3.json
+DEFAULT_JOBS = {
+    'collect': {'interval_minutes': 60, 'jitter_minutes': 5},
+    'verify': {'interval_minutes': 360, 'jitter_minutes': 15},
+    'summary': {'interval_minutes': 1440, 'jitter_minutes': 30},
+    'download': {'interval_minutes': 1440, 'jitter_minutes': 30, 'enabled': False},
+    'clean-logs': {'interval_minutes': 1440, 'jitter_minutes': 30}
+}
+
+
+@contextmanager
+def job_lock(name, directory='logs'):
+    """Hold an exclusive lock on <directory>/<name>.lock for the duration, yielding False if it is already held
+
+    flock() locks belong to the open file, so this keeps a cron run, a daemon and a second
+    thread of the same daemon from running the same job at once. The OS drops the lock if the
+    holder dies, so there is never a stale lock to clean up.
+    """
+    with open(os.path.join(directory, f"{name}.lock"), 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            lock_file.truncate(0)
+            lock_file.write(f"{os.getpid()}\n")
+            lock_file.flush()
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_job_config(config):
+    """Merge the optional 'daemon' section of creds_v3.json over DEFAULT_JOBS"""
+    jobs = {name: dict(job) for name, job in DEFAULT_JOBS.items()}
+    for name, overrides in (config or {}).get('jobs', {}).items():
+        if name in jobs:
+            jobs[name].update(overrides)
+        else:
+            logging.warning(f"Ignoring unknown daemon job '{name}'")
+    return jobs
+
+
+class Daemon:
+    """Runs jobs on their own interval plus random jitter until SIGTERM or SIGINT
+
+    Every job runs on its own thread under job_lock(), so a slow download never delays a
+    collection, and a job that is still running when it comes due again is skipped rather
+    than started twice. On shutdown no new runs start and running ones are allowed to finish.
+    """
+
+    def __init__(self, tick_seconds=5):
+        self.tick_seconds = tick_seconds
+        self.jobs = {}
+        self.threads = {}
+        self.stop_event = threading.Event()
+
+    def add_job(self, name, run, interval_minutes, jitter_minutes=0, run_on_start=True):
+        # Stagger the first runs by their jitter so jobs due at start-up don't all fire at once
+        first_delay = random.uniform(0, jitter_minutes * 60) if run_on_start else interval_minutes * 60
+        self.jobs[name] = {
+            'run': run,
+            'interval': interval_minutes * 60,
+            'jitter': jitter_minutes * 60,
+            'next_run': time.time() + first_delay,
+            'runs': 0,
+            'failures': 0,
+            'skipped': 0
+        }
+        logging.info(f"Daemon job {name}: every {interval_minutes} min (+ up to {jitter_minutes} min jitter)")
+
+    def request_stop(self, signum=None, frame=None):
+        if self.stop_event.is_set():
+            # A second signal means don't wait for running jobs
+            logging.warning("Second stop signal, exiting without waiting for running jobs")
+            raise SystemExit(1)
+        logging.info(f"Stop requested ({signal.Signals(signum).name if signum else 'shutdown'}), finishing running jobs")
+        print("🛑 Stopping after running jobs finish (send again to exit now)")
+        self.stop_event.set()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+
+    def run(self, on_new_day=None, on_tick=None):
+        """Schedule jobs until stopped, then wait for running jobs to finish"""
+        today = datetime.date.today()
+
+        while not self.stop_event.is_set():
+            if on_new_day and datetime.date.today() != today:
+                today = datetime.date.today()
+                on_new_day()
+            if on_tick:
+                on_tick()
+
+            now = time.time()
+            for name, job in self.jobs.items():
+                if now < job['next_run']:
+                    continue
+                job['next_run'] = now + job['interval'] + random.uniform(0, job['jitter'])
+                thread = self.threads.get(name)
+                if thread and thread.is_alive():
+                    job['skipped'] += 1
+                    logging.warning(f"Daemon job {name} is still running from its last run, skipping this one")
+                    continue
+                self.threads[name] = threading.Thread(target=self._run_job, args=(name, job), name=f"daemon-{name}", daemon=True)
+                self.threads[name].start()
+
+            next_due = min((job['next_run'] for job in self.jobs.values()), default=now + self.tick_seconds)
+            self.stop_event.wait(max(0.1, min(self.tick_seconds, next_due - time.time())))
+
+        for name, thread in self.threads.items():
+            if thread.is_alive():
+                logging.info(f"Waiting for daemon job {name} to finish")
+                thread.join()
+        logging.info(f"Daemon stopped: {self.summary()}")
+
+    def _run_job(self, name, job):
+        with job_lock(name) as acquired:
+            if not acquired:
+                job['skipped'] += 1
+                logging.warning(f"Daemon job {name} is already running in another process, skipping")
+                return
+            started = time.monotonic()
+            try:
+                job['run']()
+                job['runs'] += 1
+                metrics.record_run(name, True, time.monotonic() - started)
+                logging.info(f"Daemon job {name} finished in {time.monotonic() - started:.1f}s")
+            except Exception as err:
+                job['failures'] += 1
+                metrics.record_run(name, False, time.monotonic() - started)
+                logging.error(f"Daemon job {name} failed after {time.monotonic() - started:.1f}s: {err}", exc_info=True)
+
+    def summary(self) -> dict:
+        return {name: {key: job[key] for key in ('runs', 'failures', 'skipped')} for name, job in self.jobs.items()}
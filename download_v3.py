@@ -1,74 +1,169 @@
 from utilities_v3 import *
-from pymongo import MongoClient
-import os
+from daemon_v3 import job_lock
+from library_index_v3 import LibraryIndex, normalize_name, split_track_filename
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os, subprocess, threading
 
-# MongoDB connection - get from credentials (remote-friendly)
-with open('creds_v3.json') as file:
-    credentials = json.load(file)
+# MongoDB connection - shared with collect_playlists_v3 (see mongo_v3.py)
+from mongo_v3 import songs_collection
 
-mongo_config = credentials.get('mongodb', {})
-mongo_host = mongo_config.get('host', 'localhost')
-mongo_port = mongo_config.get('port', 27017)
-mongo_db_name = mongo_config.get('database', 'spotify_collection')
-mongo_username = mongo_config.get('username', None)
-mongo_password = mongo_config.get('password', None)
 
-if mongo_username and mongo_password:
-    mongo_connection_string = f"mongodb://{mongo_username}:{mongo_password}@{mongo_host}:{mongo_port}/"
-else:
-    mongo_connection_string = f"mongodb://{mongo_host}:{mongo_port}/"
+# Set from the 'download' section of creds_v3.json by configure()
+MUSIC_DIR = "/Volumes/data/media/zotify/Music/"
+LIBRARY_INDEX_PATH = 'library_index.json'
+ZOTIFY_PATH = '/opt/homebrew/bin/zotify'
+DOWNLOAD_WORKERS = 1
+DOWNLOAD_TIMEOUT = 1800
+DOWNLOAD_REAL_TIME = True
 
-mongo_client = MongoClient(mongo_connection_string)
-db = mongo_client[mongo_db_name]
-songs_collection = db['songs']
+
+def configure():
+    """Load the credentials and apply their download section"""
+    global MUSIC_DIR, LIBRARY_INDEX_PATH, ZOTIFY_PATH, DOWNLOAD_WORKERS, DOWNLOAD_TIMEOUT, DOWNLOAD_REAL_TIME
+    download_config = load_credentials().get('download', {})
+    MUSIC_DIR = download_config.get('music_dir', MUSIC_DIR)
+    LIBRARY_INDEX_PATH = download_config.get('library_index', LIBRARY_INDEX_PATH)
+    ZOTIFY_PATH = download_config.get('zotify', ZOTIFY_PATH)
+    DOWNLOAD_WORKERS = max(1, int(download_config.get('workers', DOWNLOAD_WORKERS)))
+    DOWNLOAD_TIMEOUT = download_config.get('timeout', DOWNLOAD_TIMEOUT)
+    DOWNLOAD_REAL_TIME = download_config.get('real_time', DOWNLOAD_REAL_TIME)
+
+
+# Kept between runs when the daemon calls daily_download() repeatedly
+_library = None
+
+
+def get_library_index():
+    """The LibraryIndex for MUSIC_DIR, read from disk once per process and refreshed incrementally after that"""
+    global _library
+    if _library is None or (_library.root, _library.index_path) != (MUSIC_DIR, LIBRARY_INDEX_PATH):
+        _library = LibraryIndex(MUSIC_DIR, LIBRARY_INDEX_PATH)
+    return _library
+
+
+def expected_song_path(song):
+    """Where zotify's album library layout should put this song, relative to the music dir"""
+    # Stored fields can be null, not just missing
+    artist = song.get('artist') or 'Unknown Artist'
+    album = song.get('album') or 'Unknown Album'
+    track_number = song.get('track_number') or ''
+    song_name = song.get('title') or 'Unknown Title'
+    ext = 'mp3'
+    # Build expected file path (adjust if zotify changes structure)
+    # Example: /Volumes/data/media/zotify/Music/Artist/Album/01 - Song Name.mp3
+    safe_artist = artist.replace('/', '_')
+    safe_album = album.replace('/', '_')
+    safe_song_name = song_name.replace('/', '_')
+    if track_number:
+        filename = f"{str(track_number).zfill(2)} - {safe_song_name}.{ext}"
+    else:
+        filename = f"{safe_song_name}.{ext}"
+    return os.path.join(safe_artist, safe_album, filename)
+
+
+def run_zotify(uri, music_dir):
+    """Run one zotify download as a subprocess and return (exit_code, duration_seconds, timed_out)"""
+    command = [ZOTIFY_PATH, uri, '--audio-format=mp3', f'--album-library={music_dir}']
+    if DOWNLOAD_REAL_TIME:
+        command.insert(2, '--download-real-time')
+
+    started = time.monotonic()
+    try:
+        completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=DOWNLOAD_TIMEOUT)
+        if completed.returncode != 0:
+            logging.warning(f"zotify exited with {completed.returncode} for {uri}: {completed.stderr.decode(errors='replace')[-500:]}")
+        return completed.returncode, time.monotonic() - started, False
+    except subprocess.TimeoutExpired:
+        logging.warning(f"zotify timed out after {DOWNLOAD_TIMEOUT}s for {uri}")
+        return None, time.monotonic() - started, True
 
 
 def daily_download():
-    music_dir = "/Volumes/data/media/zotify/Music/"
+    music_dir = MUSIC_DIR
     if not os.path.isdir(music_dir):
         print(f"ERROR: Music directory '{music_dir}' is not accessible. Please connect to the NAS and try again.")
         return
-    not_downloaded_yet = list(songs_collection.find({'downloaded': False}))
-    song_count = 0
-
-    def count_mp3_files(root_dir):
-        count = 0
-        for dirpath, dirnames, filenames in os.walk(root_dir):
-            count += len([f for f in filenames if f.lower().endswith('.mp3')])
-        return count
-
-    for song in not_downloaded_yet:
-        try:
-            uri = song.get('uri')
-            artist = song.get('artist', 'Unknown Artist')
-            album = song.get('album', 'Unknown Album')
-            track_number = song.get('track_number', '')
-            song_name = song.get('title', 'Unknown Title')
-            ext = 'mp3'
-            # Build expected file path (adjust if zotify changes structure)
-            # Example: /Volumes/data/media/zotify/Music/Artist/Album/01 - Song Name.mp3
-            safe_artist = artist.replace('/', '_')
-            safe_album = album.replace('/', '_')
-            safe_song_name = song_name.replace('/', '_')
-            if track_number:
-                filename = f"{str(track_number).zfill(2)} - {safe_song_name}.{ext}"
-            else:
-                filename = f"{safe_song_name}.{ext}"
-            before_count = count_mp3_files(music_dir)
-            result = os.system(f"/opt/homebrew/bin/zotify '{uri}' --download-real-time --audio-format=mp3 --album-library={music_dir}")
-            after_count = count_mp3_files(music_dir)
-            if result == 0 and after_count == before_count + 1:
-                songs_collection.update_one({'_id': song['_id']}, {'$set': {'downloaded': True}})
+    not_downloaded_yet = songs_collection.find(
+        {'downloaded': False},
+        {'uri': 1, 'artist': 1, 'album': 1, 'track_number': 1, 'title': 1}
+    )
+
+    # Only directories that changed since the last run are re-listed
+    library = get_library_index()
+    library.refresh()
+    library_lock = threading.Lock()
+    # New mp3s seen by a refresh but not yet matched to a job - with several jobs running, a refresh can see another job's file
+    unclaimed_mp3s = set()
+
+    def download_song(song):
+        expected_path = expected_song_path(song)
+        exit_code, duration, timed_out = run_zotify(song.get('uri'), music_dir)
+
+        with library_lock:
+            unclaimed_mp3s.update(path for path in library.refresh() if path.lower().endswith('.mp3'))
+            # Prefer the expected file; zotify's naming can differ (songs rarely store album/track), so match on title too
+            if expected_path in library:
+                file_path = expected_path
             else:
-                logging.warning(f"Download for {song.get('_id')} did not increase mp3 count in {music_dir}")
-            song_count += 1
-        except Exception as err:
-            logging.error(f"Error downloading {song.get('_id')}: {err}", exc_info=True)
+                # Whole-title equality, so 'Love' never claims 'Lovely.mp3'
+                title = normalize_name(song.get('title') or '')
+                candidates = [path for path in unclaimed_mp3s if title and normalize_name(split_track_filename(os.path.basename(path))) == title]
+                file_path = candidates[0] if len(candidates) == 1 else None
+            unclaimed_mp3s.discard(file_path)
+
+        job = {'exit_code': exit_code, 'duration': round(duration, 1), 'timed_out': timed_out, 'finished': datetime.datetime.now()}
+        update = {'last_download': job}
+        if exit_code == 0 and file_path:
+            update.update({'downloaded': True, 'file_path': file_path})
+        else:
+            logging.warning(f"Download for {song.get('_id')} did not produce {expected_path} in {music_dir} (exit {exit_code}, {duration:.0f}s)")
+        songs_collection.update_one({'_id': song['_id']}, {'$set': update})
+        return job, bool(update.get('downloaded'))
+
+    # Songs already on disk (earlier runs, manual imports) are marked downloaded without starting zotify
+    library_metadata = library.metadata_index()
+    skipped_count = 0
+
+    jobs = []
+    try:
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            futures = {}
+            for song in not_downloaded_yet:
+                existing_path = library.find_song(library_metadata, song.get('artist'), song.get('album'), song.get('title'))
+                if existing_path:
+                    songs_collection.update_one({'_id': song['_id']}, {'$set': {'downloaded': True, 'file_path': existing_path}})
+                    logging.info(f"Skipping download of {song.get('title')} by {song.get('artist')} - already in library at {existing_path}")
+                    skipped_count += 1
+                    continue
+                futures[executor.submit(download_song, song)] = song
+            for future in as_completed(futures):
+                song = futures[future]
+                try:
+                    job, downloaded = future.result()
+                    jobs.append((job, downloaded))
+                    logging.info(f"Downloaded {song.get('title')} by {song.get('artist')}: exit {job['exit_code']} in {job['duration']}s")
+                except Exception as err:
+                    logging.error(f"Error downloading {song.get('_id')}: {err}", exc_info=True)
+    finally:
+        library.save()
+
+    if skipped_count:
+        logging.info(f"Skipped {skipped_count} songs that were already in the library")
 
+    song_count = len(jobs)
     if song_count > 0:
-        logging.info(f"Successfully processed {song_count} songs.")
+        downloaded_count = sum(1 for _, downloaded in jobs if downloaded)
+        timed_out_count = sum(1 for job, _ in jobs if job['timed_out'])
+        total_duration = sum(job['duration'] for job, _ in jobs)
+        logging.info(f"Successfully processed {song_count} songs with {DOWNLOAD_WORKERS} workers: {downloaded_count} downloaded, {timed_out_count} timed out, {total_duration:.0f}s of zotify time")
     else:
         logging.info(f"😮‍💨 No songs since last email 😮‍💨")
 
 if __name__ == '__main__':
-    daily_download()
+    initialize()
+    configure()
+    with job_lock('download') as acquired:
+        if acquired:
+            daily_download()
+        else:
+            logging.info("Download is already running (cron or daemon), skipping")
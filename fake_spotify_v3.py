@@ -0,0 +1,365 @@
+import argparse, collections, json, random, re, threading, time, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for the parts of the Spotify Web API the collector uses, serving a synthetic
+# library. Point the 'http' section of creds_v3.json at it with api_url / accounts_url.
+
+
+class FakeLibrary:
+    """A seeded synthetic library: yearly playlists of tracks_per_playlist tracks, a collection and a country playlist, and liked songs"""
+
+    def __init__(self, playlists=3, tracks_per_playlist=200, liked=100, artists=200, country_share=0.2, seed=0):
+        rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.artists = {}
+        for i in range(artists):
+            artist_id = f"artist{i:016d}"
+            genres = ['country', 'americana'] if rng.random() < country_share else rng.sample(['indie rock', 'pop', 'hip hop', 'jazz', 'electronic', 'folk'], 2)
+            self.artists[artist_id] = {'id': artist_id, 'name': f"Artist {i}", 'genres': genres, 'type': 'artist', 'uri': f"spotify:artist:{artist_id}"}
+        artist_ids = list(self.artists)
+
+        # Enough tracks that playlists overlap a little and liked songs are mostly new
+        self.tracks = {}
+        for i in range(playlists * tracks_per_playlist + liked):
+            track_id = f"track{i:017d}"
+            artist = self.artists[rng.choice(artist_ids)]
+            self.tracks[track_id] = {
+                'id': track_id,
+                'name': f"Song {i}",
+                'uri': f"spotify:track:{track_id}",
+                'artists': [{'id': artist['id'], 'name': artist['name']}],
+                'album': {'name': f"Album {i // 12}", 'images': [{'url': f"https://i.scdn.co/image/{track_id}", 'height': 640, 'width': 640}]}
+            }
+        track_ids = list(self.tracks)
+
+        self.playlists = {}
+        yearly_ids = []
+        for i in range(playlists):
+            playlist_id = f"yearly{i:016d}"
+            yearly_ids.append(playlist_id)
+            self._create_playlist(playlist_id, f"Yearly {2020 + i}", track_ids[i * tracks_per_playlist:(i + 1) * tracks_per_playlist])
+        self._create_playlist('collection000000000000', 'Collection', [t for p in yearly_ids for t in self.playlists[p]['tracks']])
+        self._create_playlist('country0000000000000000', 'Country', [])
+
+        self.liked = track_ids[playlists * tracks_per_playlist:]
+        # A few liked songs are already in the newest playlist, like songs re-liked by hand
+        if yearly_ids:
+            self.liked += rng.sample(self.playlists[yearly_ids[-1]]['tracks'], min(5, tracks_per_playlist))
+
+        self.yearly_ids = yearly_ids
+
+    @classmethod
+    def from_capture(cls, records):
+        """A library holding the playlists captured by capture_v3, for replaying them to the collector
+
+        Tracks are placed by their captured page offset, the newest capture of a page winning, so
+        pages that were not sampled are simply missing. Captures hold no genres or liked songs.
+        """
+        library = cls(playlists=0, tracks_per_playlist=0, liked=0, artists=0)
+        library.playlists = {}
+        positions = {}
+        names = {}
+        for record in records:
+            if record.get('kind') != 'playlist_tracks' or 'items' not in record.get('response', {}):
+                continue
+            playlist_id = record['playlist_id']
+            names[playlist_id] = record.get('playlist_name') or playlist_id
+            for position, item in enumerate(record['response']['items'], start=record.get('offset', 0)):
+                track = (item or {}).get('track')
+                if not track or not track.get('id'):
+                    continue
+                library.tracks[track['id']] = track
+                positions.setdefault(playlist_id, {})[position] = track['id']
+                for artist in track.get('artists', []):
+                    if artist.get('id'):
+                        library.artists.setdefault(artist['id'], {'id': artist['id'], 'name': artist.get('name', ''), 'genres': [], 'type': 'artist', 'uri': f"spotify:artist:{artist['id']}"})
+        for playlist_id, tracks in positions.items():
+            library._create_playlist(playlist_id, names[playlist_id], [tracks[position] for position in sorted(tracks)])
+        return library
+
+    def _create_playlist(self, playlist_id, name, track_ids):
+        self.playlists[playlist_id] = {'id': playlist_id, 'name': name, 'tracks': list(track_ids), 'snapshot_id': uuid.uuid4().hex}
+
+    def creds_config(self) -> dict:
+        """The playlist sections of creds_v3.json that match this library"""
+        return {
+            'collections': {'yearly_playlist_collection': {'playlist_ids': self.yearly_ids, 'destination_id': 'collection000000000000'}},
+            'country_collection_id': 'country0000000000000000'
+        }
+
+
+class FakeSpotifyServer(ThreadingHTTPServer):
+    """Serves a FakeLibrary with optional latency and injected 429s, counting calls per endpoint"""
+
+    daemon_threads = True
+
+    def __init__(self, library, host='127.0.0.1', port=0, latency_ms=0, latency_jitter_ms=0, rate_limit_rate=0.0, retry_after=0, seed=0):
+        super().__init__((host, port), FakeSpotifyHandler)
+        self.library = library
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.calls = collections.Counter()
+        self.rate_limited = collections.Counter()
+        self.counter_lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self):
+        """Serve on a background thread and return self"""
+        self.thread = threading.Thread(target=self.serve_forever, name='fake-spotify', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def stats(self) -> dict:
+        with self.counter_lock:
+            return {'calls': dict(self.calls), 'rate_limited': dict(self.rate_limited), 'total': sum(self.calls.values())}
+
+    def reset_stats(self):
+        with self.counter_lock:
+            self.calls.clear()
+            self.rate_limited.clear()
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    # (method, pattern, handler name); the pattern's groups are passed to the handler
+    ROUTES = [
+        ('POST', r'/api/token', 'token'),
+        ('GET', r'/v1/playlists/([^/]+)', 'get_playlist'),
+        ('GET', r'/v1/playlists/([^/]+)/tracks', 'get_playlist_tracks'),
+        ('POST', r'/v1/playlists/([^/]+)/tracks', 'add_playlist_tracks'),
+        ('GET', r'/v1/me/tracks', 'get_liked'),
+        ('DELETE', r'/v1/me/tracks', 'delete_liked'),
+        ('GET', r'/v1/artists', 'get_artists'),
+        ('GET', r'/v1/artists/([^/]+)', 'get_artist'),
+        ('GET', r'/_stats', 'get_stats'),
+        ('POST', r'/_reset', 'reset')
+    ]
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        parsed = urlparse(self.path)
+        self.query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+
+        for route_method, pattern, name in self.ROUTES:
+            match = re.fullmatch(pattern, parsed.path)
+            if route_method == method and match:
+                break
+        else:
+            return self.send_json(404, {'error': {'status': 404, 'message': 'Service not found'}})
+
+        server = self.server
+        endpoint = f"{method} {pattern.replace('([^/]+)', '{id}')}"
+        if not parsed.path.startswith('/_'):
+            with server.counter_lock:
+                server.calls[endpoint] += 1
+                limited = server.rng.random() < server.rate_limit_rate
+                if limited:
+                    server.rate_limited[endpoint] += 1
+            if server.latency_ms or server.latency_jitter_ms:
+                time.sleep((server.latency_ms + server.rng.uniform(0, server.latency_jitter_ms)) / 1000)
+            if limited:
+                return self.send_json(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}}, {'Retry-After': str(server.retry_after)})
+
+        getattr(self, name)(*match.groups())
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def json_body(self):
+        try:
+            return json.loads(self.body or b'{}')
+        except ValueError:
+            return None
+
+    def page_params(self, default_limit, max_limit):
+        offset = int(self.query.get('offset', 0))
+        limit = int(self.query.get('limit', default_limit))
+        if limit < 1 or limit > max_limit or offset < 0:
+            return None
+        return offset, limit
+
+    def bad_request(self, message):
+        self.send_json(400, {'error': {'status': 400, 'message': message}})
+
+    def filter_fields(self, payload):
+        # Only flat field lists such as fields=snapshot_id or fields=name,snapshot_id are supported
+        fields = self.query.get('fields')
+        if not fields:
+            return payload
+        return {key: payload[key] for key in fields.split(',') if key in payload}
+
+    # Endpoints
+
+    def token(self):
+        form = {key: values[-1] for key, values in parse_qs(self.body.decode('utf-8')).items()}
+        if form.get('grant_type') not in ('refresh_token', 'authorization_code'):
+            return self.send_json(400, {'error': 'unsupported_grant_type'})
+        self.send_json(200, {
+            'access_token': f"fake-{uuid.uuid4().hex}",
+            'token_type': 'Bearer',
+            'expires_in': 3600,
+            'scope': 'playlist-modify-public playlist-modify-private user-library-modify user-library-read'
+        })
+
+    def get_playlist(self, playlist_id):
+        library = self.server.library
+        with library.lock:
+            playlist = library.playlists.get(playlist_id)
+            if not playlist:
+                return self.send_json(404, {'error': {'status': 404, 'message': 'Not found.'}})
+            payload = {
+                'id': playlist_id,
+                'name': playlist['name'],
+                'snapshot_id': playlist['snapshot_id'],
+                'tracks': {'total': len(playlist['tracks'])}
+            }
+        self.send_json(200, self.filter_fields(payload))
+
+    def get_playlist_tracks(self, playlist_id):
+        params = self.page_params(100, 100)
+        if params is None:
+            return self.bad_request('Invalid limit')
+        offset, limit = params
+        library = self.server.library
+        with library.lock:
+            playlist = library.playlists.get(playlist_id)
+            if not playlist:
+                return self.send_json(404, {'error': {'status': 404, 'message': 'Not found.'}})
+            track_ids = playlist['tracks'][offset:offset + limit]
+            items = [{'added_at': '2024-01-01T00:00:00Z', 'track': library.tracks[track_id]} for track_id in track_ids]
+            total = len(playlist['tracks'])
+        self.send_json(200, {'items': items, 'total': total, 'offset': offset, 'limit': limit, 'next': None if offset + limit >= total else 'next'})
+
+    def add_playlist_tracks(self, playlist_id):
+        body = self.json_body()
+        uris = (body or {}).get('uris') or []
+        if not uris or len(uris) > 100:
+            return self.bad_request('You can add a maximum of 100 tracks per request.')
+        library = self.server.library
+        with library.lock:
+            playlist = library.playlists.get(playlist_id)
+            if not playlist:
+                return self.send_json(404, {'error': {'status': 404, 'message': 'Not found.'}})
+            track_ids = [uri.rsplit(':', 1)[-1] for uri in uris]
+            if any(track_id not in library.tracks for track_id in track_ids):
+                return self.bad_request('Invalid base62 id')
+            playlist['tracks'].extend(track_ids)
+            playlist['snapshot_id'] = uuid.uuid4().hex
+            snapshot_id = playlist['snapshot_id']
+        self.send_json(201, {'snapshot_id': snapshot_id})
+
+    def get_liked(self):
+        params = self.page_params(20, 50)
+        if params is None:
+            return self.bad_request('Invalid limit')
+        offset, limit = params
+        library = self.server.library
+        with library.lock:
+            items = [{'added_at': '2024-01-01T00:00:00Z', 'track': library.tracks[track_id]} for track_id in library.liked[offset:offset + limit]]
+            total = len(library.liked)
+        self.send_json(200, {'items': items, 'total': total, 'offset': offset, 'limit': limit})
+
+    def delete_liked(self):
+        ids = (self.json_body() or {}).get('ids') or self.query.get('ids', '').split(',')
+        ids = [track_id for track_id in ids if track_id]
+        if not ids or len(ids) > 50:
+            return self.bad_request('Too many ids requested')
+        library = self.server.library
+        with library.lock:
+            removing = set(ids)
+            library.liked = [track_id for track_id in library.liked if track_id not in removing]
+        self.send_json(200, {})
+
+    def get_artists(self):
+        ids = [artist_id for artist_id in self.query.get('ids', '').split(',') if artist_id]
+        if not ids or len(ids) > 50:
+            return self.bad_request('Too many ids requested')
+        artists = self.server.library.artists
+        self.send_json(200, {'artists': [artists.get(artist_id) for artist_id in ids]})
+
+    def get_artist(self, artist_id):
+        artist = self.server.library.artists.get(artist_id)
+        if not artist:
+            return self.send_json(404, {'error': {'status': 404, 'message': 'Not found.'}})
+        self.send_json(200, artist)
+
+    def get_stats(self):
+        self.send_json(200, self.server.stats())
+
+    def reset(self):
+        self.server.reset_stats()
+        self.send_json(200, {})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a synthetic Spotify library for local runs and benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--playlists', type=int, default=3, help='Yearly playlists to generate (default: 3)')
+    parser.add_argument('--tracks', type=int, default=200, help='Tracks per yearly playlist (default: 200)')
+    parser.add_argument('--liked', type=int, default=100, help='Liked songs waiting to be processed (default: 100)')
+    parser.add_argument('--artists', type=int, default=200, help='Distinct artists (default: 200)')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Added to every API response (default: 0)')
+    parser.add_argument('--latency-jitter-ms', type=float, default=0, help='Random extra latency of up to this much (default: 0)')
+    parser.add_argument('--rate-limit', type=float, default=0, help='Fraction of API calls answered with 429 (default: 0)')
+    parser.add_argument('--retry-after', type=int, default=0, help='Retry-After seconds sent with injected 429s (default: 0)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--from-capture', metavar='DIR', help='Serve the playlists captured in DIR by capture_v3 instead of a synthetic library')
+    args = parser.parse_args()
+
+    if args.from_capture:
+        from capture_v3 import read_records
+        library = FakeLibrary.from_capture(read_records(args.from_capture))
+    else:
+        library = FakeLibrary(args.playlists, args.tracks, args.liked, args.artists, seed=args.seed)
+    server = FakeSpotifyServer(
+        library, args.host, args.port,
+        latency_ms=args.latency_ms, latency_jitter_ms=args.latency_jitter_ms,
+        rate_limit_rate=args.rate_limit, retry_after=args.retry_after, seed=args.seed
+    )
+    print(f"🎧 Fake Spotify on {server.url} - add this to creds_v3.json:")
+    if args.from_capture:
+        print(json.dumps({'http': {'api_url': server.url, 'accounts_url': server.url}}, indent=2))
+        for playlist_id, playlist in library.playlists.items():
+            print(f"  {playlist_id}: {playlist['name']} ({len(playlist['tracks'])} tracks)")
+    else:
+        print(json.dumps({'http': {'api_url': server.url, 'accounts_url': server.url}, **library.creds_config()}, indent=2))
+    print(f"Call counts: GET {server.url}/_stats")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,134 @@
+import json, logging, os, re, tempfile, unicodedata
+
+
+def normalize_name(name) -> str:
+    """Normalize an artist, album or title so spelling variants of the same name compare equal"""
+    name = unicodedata.normalize('NFKD', str(name or '')).encode('ascii', 'ignore').decode('ascii')
+    name = name.replace('/', '_').lower()
+    name = re.sub(r'[^\w\s]', ' ', name)
+    return ' '.join(name.split())
+
+
+def split_track_filename(filename) -> str:
+    """Title part of a zotify file name such as '01 - Song Name.mp3'"""
+    stem = os.path.splitext(filename)[0]
+    return re.sub(r'^\d+\s*-\s*', '', stem)
+
+
+class LibraryIndex:
+    """Persistent index of the music library, refreshed by re-listing only directories that changed
+
+    Adding or removing an entry updates its parent directory's mtime. So a directory whose mtime
+    matches the index is walked through using its cached subdirectory list, at the cost of one
+    stat() and no listing. Over a network share that is the difference between a full tree
+    walk and a few dozen stats.
+    """
+
+    def __init__(self, root, index_path='library_index.json'):
+        self.root = root
+        self.index_path = index_path
+        # relative directory -> {'mtime_ns': int, 'dirs': [names], 'files': {name: [mtime, size]}}
+        self.dirs = {}
+        if os.path.exists(index_path):
+            try:
+                with open(index_path) as file:
+                    index = json.load(file)
+                if index.get('root') == root:
+                    self.dirs = index.get('dirs', {})
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable library index {index_path}: {e}")
+
+    def refresh(self) -> list:
+        """Bring the index up to date and return the relative paths of files added since the last refresh"""
+        added = []
+        relisted = 0
+        stack = ['']
+
+        while stack:
+            rel_dir = stack.pop()
+            full_dir = os.path.join(self.root, rel_dir)
+            try:
+                mtime_ns = os.stat(full_dir).st_mtime_ns
+            except FileNotFoundError:
+                self._forget(rel_dir)
+                continue
+
+            cached = self.dirs.get(rel_dir)
+            if cached and cached['mtime_ns'] == mtime_ns:
+                stack.extend(os.path.join(rel_dir, name) for name in cached['dirs'])
+                continue
+
+            relisted += 1
+            subdirs = []
+            files = {}
+            with os.scandir(full_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        files[entry.name] = [stat.st_mtime, stat.st_size]
+
+            old_files = cached['files'] if cached else {}
+            added.extend(os.path.join(rel_dir, name) for name in files if name not in old_files)
+            for name in (cached['dirs'] if cached else []):
+                if name not in subdirs:
+                    self._forget(os.path.join(rel_dir, name))
+
+            self.dirs[rel_dir] = {'mtime_ns': mtime_ns, 'dirs': subdirs, 'files': files}
+            stack.extend(os.path.join(rel_dir, name) for name in subdirs)
+
+        logging.info(f"Library index refreshed: re-listed {relisted} of {len(self.dirs)} directories, {len(added)} new files")
+        return added
+
+    def _forget(self, rel_dir):
+        """Drop a directory and everything below it from the index"""
+        cached = self.dirs.pop(rel_dir, None)
+        if cached:
+            for name in cached['dirs']:
+                self._forget(os.path.join(rel_dir, name))
+
+    def __contains__(self, rel_path):
+        rel_dir, name = os.path.split(rel_path)
+        cached = self.dirs.get(rel_dir)
+        return bool(cached) and name in cached['files']
+
+    def iter_files(self):
+        """Yield the relative path of every indexed file"""
+        for rel_dir, cached in self.dirs.items():
+            for name in cached['files']:
+                yield os.path.join(rel_dir, name)
+
+    def metadata_index(self) -> dict:
+        """Map (artist, album, title) and (artist, None, title), all normalized, to an indexed mp3 path
+
+        Built from the Artist/Album/NN - Title.mp3 layout of the album library. The album-less key
+        matters because most songs in MongoDB do not store their album.
+        """
+        metadata = {}
+        for path in self.iter_files():
+            if not path.lower().endswith('.mp3'):
+                continue
+            parts = path.split(os.sep)
+            if len(parts) < 3:
+                continue
+            artist, album, title = normalize_name(parts[-3]), normalize_name(parts[-2]), normalize_name(split_track_filename(parts[-1]))
+            metadata.setdefault((artist, album, title), path)
+            metadata.setdefault((artist, None, title), path)
+        return metadata
+
+    def find_song(self, metadata, artist, album, title):
+        """Look up a song in a metadata_index() result, falling back to artist and title only"""
+        artist, title = normalize_name(artist), normalize_name(title)
+        if album:
+            path = metadata.get((artist, normalize_name(album), title))
+            if path:
+                return path
+        return metadata.get((artist, None, title))
+
+    def save(self):
+        """Atomically write the index next to index_path"""
+        directory = os.path.dirname(os.path.abspath(self.index_path))
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, delete=False, suffix='.tmp') as f:
+            json.dump({'root': self.root, 'dirs': self.dirs}, f)
+        os.replace(f.name, self.index_path)
@@ -0,0 +1,177 @@
+import bisect, logging, os, re, tempfile, threading, time
+from urllib.parse import urlparse
+
+# In-process counters and latency histograms for Spotify API calls and MongoDB commands,
+# written as a textfile for node_exporter's textfile collector.
+
+PREFIX = 'spotify_collector'
+
+# Seconds; covers a fast local Mongo command up to a Spotify call that sat behind a Retry-After
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# name -> (type, help). Counters keep their _total suffix in the family name so node_exporter's
+# text parser, which predates OpenMetrics, matches the samples to their TYPE line.
+FAMILIES = {
+    'spotify_requests_total': ('counter', 'Spotify API requests by endpoint and response status ("error" for connection failures)'),
+    'spotify_request_duration_seconds': ('histogram', 'Spotify API request latency by endpoint'),
+    'mongo_operations_total': ('counter', 'MongoDB commands by collection, command and outcome'),
+    'mongo_operation_duration_seconds': ('histogram', 'MongoDB command latency by collection and command'),
+    'run_duration_seconds': ('gauge', 'Duration of the last run of each command or daemon job'),
+    'run_success': ('gauge', '1 if the last run of each command or daemon job succeeded, else 0'),
+    'last_run_timestamp_seconds': ('gauge', 'When the last run of each command or daemon job finished')
+}
+
+# Spotify ids in paths become {id} so every playlist shares one series
+ID_SEGMENT = re.compile(r'/(playlists|artists|albums|users)/[^/]+')
+
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and histograms keyed by family and label values"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self.histograms = {}
+        self.enabled = False
+        self.textfile_dir = None
+        self.interval_seconds = 60
+        self.source = 'collect'
+        self.last_export = 0
+
+    def configure(self, config, source='collect'):
+        """Apply the optional 'metrics' section of creds_v3.json; source names the command or daemon doing the exporting"""
+        self.enabled = config.get('enabled', False)
+        self.textfile_dir = config.get('textfile_dir', 'logs/metrics')
+        self.interval_seconds = config.get('interval_seconds', 60)
+        self.source = source
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            histogram[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+            histogram[-1] += value
+
+    def record_spotify_request(self, method, url, status, seconds):
+        labels = {'method': method, 'endpoint': ID_SEGMENT.sub(r'/\1/{id}', urlparse(url).path)}
+        self.inc('spotify_requests_total', {**labels, 'status': str(status)})
+        self.observe('spotify_request_duration_seconds', labels, seconds)
+
+    def record_mongo_command(self, collection, command, outcome, seconds):
+        labels = {'collection': collection, 'command': command}
+        self.inc('mongo_operations_total', {**labels, 'outcome': outcome})
+        self.observe('mongo_operation_duration_seconds', labels, seconds)
+
+    def record_run(self, command, succeeded, seconds):
+        labels = {'command': command}
+        self.set('run_duration_seconds', labels, seconds)
+        self.set('run_success', labels, 1 if succeeded else 0)
+        self.set('last_run_timestamp_seconds', labels, time.time())
+
+    def render(self) -> str:
+        """Everything recorded so far in the Prometheus/OpenMetrics text format"""
+        with self.lock:
+            samples = {}
+            for (name, labels), value in self.counters.items():
+                samples.setdefault(name, []).append((name, labels, value))
+            for (name, labels), value in self.gauges.items():
+                samples.setdefault(name, []).append((name, labels, value))
+            for (name, labels), histogram in self.histograms.items():
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), histogram[:-1]):
+                    cumulative += count
+                    samples.setdefault(name, []).append((f"{name}_bucket", labels + (('le', str(bound)),), cumulative))
+                samples[name].append((f"{name}_count", labels, cumulative))
+                samples[name].append((f"{name}_sum", labels, histogram[-1]))
+
+        lines = []
+        for name, (metric_type, help_text) in FAMILIES.items():
+            if name not in samples:
+                continue
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {metric_type}")
+            for sample_name, labels, value in samples[name]:
+                label_text = ','.join(f'{key}="{escape_label(value)}"' for key, value in (('source', self.source),) + labels)
+                lines.append(f"{PREFIX}_{sample_name}{{{label_text}}} {format_value(value)}")
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def textfile_path(self) -> str:
+        # One file per source, so a verify run never overwrites the series of the last collect
+        return os.path.join(self.textfile_dir, f"{PREFIX}_{self.source}.prom")
+
+    def export(self):
+        """Atomically write the textfile if metrics are enabled"""
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(self.textfile_dir, exist_ok=True)
+            # node_exporter must never read a half-written file, so write next to it and rename
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.textfile_dir, delete=False, suffix='.tmp') as f:
+                f.write(self.render())
+            os.chmod(f.name, 0o644)
+            os.replace(f.name, self.textfile_path())
+            self.last_export = time.monotonic()
+        except OSError as e:
+            logging.error(f"Error writing metrics to {self.textfile_dir}: {e}")
+
+    def export_if_due(self):
+        """Export when interval_seconds have passed since the last export (for the daemon loop)"""
+        if self.enabled and time.monotonic() - self.last_export >= self.interval_seconds:
+            self.export()
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value) -> str:
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def mongo_command_listener(registry):
+    """A pymongo CommandListener feeding registry; pass it to MongoClient(event_listeners=[...])"""
+    from pymongo import monitoring
+
+    class MongoCommandMetrics(monitoring.CommandListener):
+        def __init__(self):
+            self.lock = threading.Lock()
+            # (connection, request) -> collection, since only the started event carries the command document
+            self.collections = {}
+
+        def started(self, event):
+            target = event.command.get(event.command_name)
+            with self.lock:
+                self.collections[(event.connection_id, event.request_id)] = target if isinstance(target, str) else ''
+
+        def succeeded(self, event):
+            self._finish(event, 'ok')
+
+        def failed(self, event):
+            self._finish(event, 'error')
+
+        def _finish(self, event, outcome):
+            with self.lock:
+                collection = self.collections.pop((event.connection_id, event.request_id), '')
+            registry.record_mongo_command(collection, event.command_name, outcome, event.duration_micros / 1_000_000)
+
+    return MongoCommandMetrics()
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,114 @@
+import threading
+from urllib.parse import quote_plus
+from utilities_v3 import load_credentials
+from metrics_v3 import metrics, mongo_command_listener
+
+# Shared MongoDB connection for collect_playlists_v3, summary_v3 and download_v3.
+# Nothing connects (or even imports pymongo) until a collection is first used.
+
+DEFAULT_DATABASE = 'spotify_collector'
+
+_lock = threading.Lock()
+_client = None
+
+
+def get_mongo_config() -> dict:
+    """The 'mongodb' section of the shared credentials"""
+    return load_credentials().get('mongodb', {})
+
+
+def connection_string(redact=False) -> str:
+    config = get_mongo_config()
+    host = config.get('host', 'localhost')
+    port = config.get('port', 27017)
+    username = config.get('username', None)
+    password = config.get('password', None)
+
+    if username and password:
+        credentials = f"{quote_plus(username)}:{'****' if redact else quote_plus(password)}@"
+    else:
+        credentials = ''
+    return f"mongodb://{credentials}{host}:{port}/"
+
+
+def database_name() -> str:
+    return get_mongo_config().get('database', DEFAULT_DATABASE)
+
+
+def get_client():
+    """Create the MongoClient on first use, with pool size, timeouts and compression from creds_v3.json"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                config = get_mongo_config()
+                options = {
+                    'maxPoolSize': config.get('max_pool_size', 20),
+                    'minPoolSize': config.get('min_pool_size', 0),
+                    'serverSelectionTimeoutMS': config.get('server_selection_timeout_ms', 10_000),
+                    'connectTimeoutMS': config.get('connect_timeout_ms', 10_000),
+                    'socketTimeoutMS': config.get('socket_timeout_ms', 60_000)
+                }
+                if config.get('compressors'):
+                    options['compressors'] = config['compressors']
+                if metrics.enabled:
+                    # Per-collection command counts and latencies for the metrics textfile
+                    options['event_listeners'] = [mongo_command_listener(metrics)]
+                _client = pymongo.MongoClient(connection_string(), **options)
+    return _client
+
+
+def get_db():
+    return get_client()[database_name()]
+
+
+def close_client():
+    """Close the shared client; the next use reconnects"""
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+class LazyPymongo:
+    """Stands in for the pymongo module, importing it once on first attribute access"""
+
+    def __init__(self):
+        self._module = None
+
+    def __getattr__(self, name):
+        if self._module is None:
+            # The import system has its own lock, and get_client() calls this while holding _lock
+            import importlib
+            self._module = importlib.import_module('pymongo')
+        return getattr(self._module, name)
+
+
+class LazyDatabase:
+    """Stands in for the pymongo Database until it is first used"""
+
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+    def __getitem__(self, name):
+        return get_db()[name]
+
+
+class LazyCollection:
+    """Stands in for a pymongo Collection until it is first used"""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, name):
+        return getattr(get_db()[self._name], name)
+
+
+pymongo = LazyPymongo()
+db = LazyDatabase()
+playlists_collection = LazyCollection('playlists')
+songs_collection = LazyCollection('songs')
+add_attempts_collection = LazyCollection('add_attempts')
+artists_collection = LazyCollection('artists')
+playlist_tracks_collection = LazyCollection('playlist_tracks')
@@ -0,0 +1,167 @@
+import argparse, fnmatch, gzip, json, logging, os, shutil, threading, time
+
+# Per-directory retention policies. Only files matching a policy's patterns are ever touched,
+# so the cron scripts and .gitkeep files in logs/ are left alone.
+DEFAULT_RETENTION = {
+    'logs': {
+        'patterns': ['*.log', '*.log.gz', 'cron_logs*.txt', 'cron_logs*.txt.gz'],
+        'rotate': {'cron_logs.txt': 5_000_000},
+        'compress_after_days': 1,
+        'max_age_days': 90,
+        'max_bytes': 200_000_000
+    },
+    'logs/json': {
+        'patterns': ['*.json'],
+        'max_age_days': 7,
+        'max_bytes': 10_000_000
+    },
+    'logs/capture': {
+        'patterns': ['*.jsonl.gz'],
+        'max_age_days': 30,
+        'max_bytes': 50_000_000
+    }
+}
+
+DAY_SECONDS = 24 * 60 * 60
+
+
+def scan_directory(directory, patterns):
+    """Return [(path, name, size, mtime)] for the regular files in directory matching any pattern"""
+    if not os.path.isdir(directory):
+        return []
+    files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            if not any(fnmatch.fnmatch(entry.name, pattern) for pattern in patterns):
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            files.append((entry.path, entry.name, stat.st_size, stat.st_mtime))
+    return files
+
+
+def compress_file(path):
+    """Gzip path next to itself, keep its mtime so age limits still apply, and remove the original"""
+    compressed_path = f"{path}.gz"
+    stat = os.stat(path)
+    with open(path, 'rb') as source, gzip.open(compressed_path, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    os.utime(compressed_path, (stat.st_atime, stat.st_mtime))
+    os.remove(path)
+    return compressed_path
+
+
+def apply_policy(directory, policy, now=None, dry_run=False):
+    """Rotate, compress and prune one directory, returning counts of what was done"""
+    now = now or time.time()
+    summary = {'rotated': 0, 'compressed': 0, 'deleted': 0, 'freed_bytes': 0}
+
+    # Rotate append-only files (e.g. the cron log) that grew past their limit
+    for name, rotate_bytes in policy.get('rotate', {}).items():
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getsize(path) >= rotate_bytes:
+                rotated_path = os.path.join(directory, f"{os.path.splitext(name)[0]}_{time.strftime('%Y-%m-%d_%H-%M-%S')}{os.path.splitext(name)[1]}")
+                logging.info(f"Rotating {path} to {rotated_path}")
+                if not dry_run:
+                    os.replace(path, rotated_path)
+                summary['rotated'] += 1
+        except FileNotFoundError:
+            pass
+
+    files = scan_directory(directory, policy['patterns'])
+    active = set(policy.get('rotate', {}))
+
+    # Compress anything that has not been written to for a while
+    compress_after_days = policy.get('compress_after_days')
+    if compress_after_days is not None:
+        for i, (path, name, size, mtime) in enumerate(files):
+            if name.endswith('.gz') or name in active or now - mtime < compress_after_days * DAY_SECONDS:
+                continue
+            logging.info(f"Compressing {path}")
+            if not dry_run:
+                try:
+                    compressed_path = compress_file(path)
+                except OSError as e:
+                    logging.error(f"Error compressing {path}: {e}")
+                    continue
+                files[i] = (compressed_path, os.path.basename(compressed_path), os.path.getsize(compressed_path), mtime)
+            summary['compressed'] += 1
+
+    def remove(path, size, reason):
+        logging.info(f"Removing {path} ({size} bytes): {reason}")
+        if not dry_run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return
+            except OSError as e:
+                logging.error(f"Error removing {path}: {e}")
+                return
+        summary['deleted'] += 1
+        summary['freed_bytes'] += size
+
+    # Age limit, then the total size budget, dropping the oldest files first
+    kept = []
+    max_age_days = policy.get('max_age_days')
+    for path, name, size, mtime in sorted(files, key=lambda f: f[3]):
+        if name not in active and max_age_days is not None and now - mtime > max_age_days * DAY_SECONDS:
+            remove(path, size, f"older than {max_age_days} days")
+        else:
+            kept.append((path, name, size, mtime))
+
+    max_bytes = policy.get('max_bytes')
+    if max_bytes is not None:
+        total = sum(f[2] for f in kept)
+        for path, name, size, mtime in kept:
+            if total <= max_bytes:
+                break
+            if name in active:
+                continue
+            remove(path, size, f"directory over {max_bytes} bytes")
+            total -= size
+
+    return summary
+
+
+def run_retention(policies=None, dry_run=False):
+    """Apply every directory policy and return {directory: summary}"""
+    policies = policies or DEFAULT_RETENTION
+    results = {}
+    for directory, policy in policies.items():
+        try:
+            results[directory] = apply_policy(directory, policy, dry_run=dry_run)
+        except Exception as e:
+            logging.error(f"Error applying retention to {directory}: {e}", exc_info=True)
+    logging.info(f"Retention results: {results}")
+    return results
+
+
+def run_retention_in_background(policies=None):
+    """Start retention on a separate thread so the caller can finish its own work first"""
+    thread = threading.Thread(target=run_retention, args=(policies,), name='log-retention')
+    thread.start()
+    return thread
+
+
+def load_policies(config):
+    """Merge the optional 'retention' section of creds_v3.json over DEFAULT_RETENTION"""
+    policies = {directory: dict(policy) for directory, policy in DEFAULT_RETENTION.items()}
+    for directory, overrides in (config or {}).items():
+        policies.setdefault(directory, {'patterns': ['*']}).update(overrides)
+    return policies
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply log retention policies to logs/')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would be rotated, compressed or removed')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    config = {}
+    if os.path.exists('creds_v3.json'):
+        with open('creds_v3.json') as file:
+            config = json.load(file).get('retention', {})
+    for directory, summary in run_retention(load_policies(config), dry_run=args.dry_run).items():
+        print(f"{directory}: {summary}")
@@ -0,0 +1,148 @@
+import logging
+from datetime import datetime, timedelta
+
+# The incrementally maintained counters live in a single document of the stats collection.
+# It only exists after rebuild_stats() has run; until then increment_stats() is a no-op.
+STATS_ID = 'totals'
+STATS_FIELDS = [
+    'cached_playlists',
+    'total_cached_songs',
+    'total_songs_in_db',
+    'logged_songs',
+    'unlogged_songs',
+    'unverified_attempts',
+    'failed_attempts'
+]
+
+
+def count_statistics(db, recent_days=7):
+    """Compute every statistic with separate per-collection counts, for servers without $unionWith (MongoDB < 4.4)"""
+    recent_cutoff = datetime.now() - timedelta(days=recent_days)
+    cached_songs = next(db['playlists'].aggregate([
+        {'$group': {'_id': None, 'total': {'$sum': {'$ifNull': ['$total_songs', 0]}}}}
+    ]), {})
+    return {
+        'cached_playlists': db['playlists'].count_documents({}),
+        'total_cached_songs': cached_songs.get('total', 0),
+        'total_songs_in_db': db['songs'].count_documents({}),
+        'logged_songs': db['songs'].count_documents({'logged': True}),
+        'unlogged_songs': db['songs'].count_documents({'logged': False}),
+        'recent_add_attempts': db['add_attempts'].count_documents({'attempt_time': {'$gt': recent_cutoff}}),
+        'recently_cached_songs': db['songs'].count_documents({'date_cached': {'$gt': recent_cutoff}}),
+        'unverified_attempts': db['add_attempts'].count_documents({'verified': False, 'verification_attempts': {'$lt': 3}}),
+        'failed_attempts': db['add_attempts'].count_documents({'verified': False, 'verification_attempts': {'$gte': 3}})
+    }
+
+
+def compute_statistics(db, recent_days=7):
+    """Compute every statistic with one projected $facet aggregation across songs, playlists and add_attempts
+    
+    $unionWith needs MongoDB 4.4 or later; older servers fall back to count_statistics().
+    """
+    from pymongo.errors import OperationFailure
+
+    recent_cutoff = datetime.now() - timedelta(days=recent_days)
+
+    def count_where(condition):
+        return {'$sum': {'$cond': [condition, 1, 0]}}
+
+    pipeline = [
+        {'$project': {'_id': 0, 'source': 'songs', 'logged': 1, 'date_cached': 1}},
+        {'$unionWith': {'coll': 'playlists', 'pipeline': [
+            {'$project': {'_id': 0, 'source': 'playlists', 'total_songs': 1}}
+        ]}},
+        {'$unionWith': {'coll': 'add_attempts', 'pipeline': [
+            {'$project': {'_id': 0, 'source': 'add_attempts', 'verified': 1, 'verification_attempts': 1, 'attempt_time': 1}}
+        ]}},
+        {'$facet': {
+            'playlists': [
+                {'$match': {'source': 'playlists'}},
+                {'$group': {
+                    '_id': None,
+                    'cached_playlists': {'$sum': 1},
+                    'total_cached_songs': {'$sum': {'$ifNull': ['$total_songs', 0]}}
+                }}
+            ],
+            'songs': [
+                {'$match': {'source': 'songs'}},
+                {'$group': {
+                    '_id': None,
+                    'total_songs_in_db': {'$sum': 1},
+                    'logged_songs': count_where({'$eq': ['$logged', True]}),
+                    'unlogged_songs': count_where({'$eq': ['$logged', False]}),
+                    'recently_cached_songs': count_where({'$gt': ['$date_cached', recent_cutoff]})
+                }}
+            ],
+            'add_attempts': [
+                {'$match': {'source': 'add_attempts'}},
+                {'$group': {
+                    '_id': None,
+                    'recent_add_attempts': count_where({'$gt': ['$attempt_time', recent_cutoff]}),
+                    'unverified_attempts': count_where({'$and': [
+                        {'$eq': ['$verified', False]}, {'$lt': ['$verification_attempts', 3]}
+                    ]}),
+                    'failed_attempts': count_where({'$and': [
+                        {'$eq': ['$verified', False]}, {'$gte': ['$verification_attempts', 3]}
+                    ]})
+                }}
+            ]
+        }}
+    ]
+
+    try:
+        facets = next(db['songs'].aggregate(pipeline), {})
+    except OperationFailure as e:
+        logging.warning(f"Single-pass statistics aggregation failed ({e}), counting each collection separately")
+        return count_statistics(db, recent_days)
+    stats = {
+        'cached_playlists': 0,
+        'total_cached_songs': 0,
+        'total_songs_in_db': 0,
+        'logged_songs': 0,
+        'unlogged_songs': 0,
+        'recent_add_attempts': 0,
+        'recently_cached_songs': 0,
+        'unverified_attempts': 0,
+        'failed_attempts': 0
+    }
+    for results in facets.values():
+        for result in results:
+            result.pop('_id', None)
+            stats.update(result)
+    return stats
+
+
+def rebuild_stats(db):
+    """Recompute the statistics and (re)create the incrementally maintained stats document"""
+    stats = compute_statistics(db)
+    db['stats'].replace_one(
+        {'_id': STATS_ID},
+        {**{field: stats[field] for field in STATS_FIELDS}, 'rebuilt_at': datetime.now(), 'updated_at': datetime.now()},
+        upsert=True
+    )
+    return stats
+
+
+def count_recent_activity(db, recent_days=7):
+    """Count the time-window statistics with two indexed range counts (date_cached, attempt_time)"""
+    recent_cutoff = datetime.now() - timedelta(days=recent_days)
+    return {
+        'recent_add_attempts': db['add_attempts'].count_documents({'attempt_time': {'$gt': recent_cutoff}}),
+        'recently_cached_songs': db['songs'].count_documents({'date_cached': {'$gt': recent_cutoff}})
+    }
+
+
+def read_stats(db):
+    """Return the counters of the stats document in constant time, or None if it has never been built"""
+    return db['stats'].find_one({'_id': STATS_ID}, {'_id': 0, **{field: 1 for field in STATS_FIELDS}})
+
+
+def increment_stats(db, **deltas):
+    """Apply counter deltas from a write path to the stats document (no-op until it is built)"""
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    db['stats'].update_one(
+        {'_id': STATS_ID},
+        {'$inc': deltas, '$set': {'updated_at': datetime.now()}}
+    )
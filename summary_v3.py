@@ -1,39 +1,63 @@
 from utilities_v3 import *
-from pymongo import MongoClient
-import os
+from daemon_v3 import job_lock
+from stats_v3 import increment_stats
+import uuid
 
-# MongoDB connection - get from credentials (remote-friendly)
-with open('creds_v3.json') as file:
-    credentials = json.load(file)
+# MongoDB connection - shared with collect_playlists_v3 (see mongo_v3.py)
+from mongo_v3 import db, songs_collection
 
-mongo_config = credentials.get('mongodb', {})
-mongo_host = mongo_config.get('host', 'localhost')
-mongo_port = mongo_config.get('port', 27017)
-mongo_db_name = mongo_config.get('database', 'spotify_collection')
-mongo_username = mongo_config.get('username', None)
-mongo_password = mongo_config.get('password', None)
 
-if mongo_username and mongo_password:
-    mongo_connection_string = f"mongodb://{mongo_username}:{mongo_password}@{mongo_host}:{mongo_port}/"
-else:
-    mongo_connection_string = f"mongodb://{mongo_host}:{mongo_port}/"
+# A claim older than this belongs to a run that died before it could commit or release it
+STALE_CLAIM_HOURS = 6
 
-mongo_client = MongoClient(mongo_connection_string)
-db = mongo_client[mongo_db_name]
-songs_collection = db['songs']
+
+def claim_unlogged_songs(run_id):
+    """Tag every unclaimed unlogged song with run_id in a single update_many and return how many were claimed"""
+    claimed = songs_collection.update_many(
+        {
+            'logged': False,
+            '$or': [
+                {'summary_run': {'$exists': False}},
+                {'summary_claimed_at': {'$lt': datetime.datetime.now() - datetime.timedelta(hours=STALE_CLAIM_HOURS)}}
+            ]
+        },
+        {'$set': {'summary_run': run_id, 'summary_claimed_at': datetime.datetime.now()}}
+    )
+    return claimed.modified_count
+
+
+def commit_claimed_songs(run_id):
+    """Mark the claimed batch as logged once the email has gone out"""
+    committed = songs_collection.update_many(
+        {'summary_run': run_id},
+        {'$set': {'logged': True}, '$unset': {'summary_run': '', 'summary_claimed_at': ''}}
+    )
+    increment_stats(db, logged_songs=committed.modified_count, unlogged_songs=-committed.modified_count)
+    return committed.modified_count
+
+
+def release_claimed_songs(run_id):
+    """Give the claimed batch back so the next run picks it up again"""
+    songs_collection.update_many(
+        {'summary_run': run_id},
+        {'$unset': {'summary_run': '', 'summary_claimed_at': ''}}
+    )
 
 
 def daily_summary():
-    table_data = ''
-    songs_added = list(songs_collection.find({'logged': False}))
-    song_count = 0
+    run_id = uuid.uuid4().hex
+    song_count = claim_unlogged_songs(run_id)
 
-    for song in songs_added:
-        song_count += 1
-        table_data += f'<tr><td><img src="{song.get("image_url", "")}" width="128px"></td><td><p>Title: "{song.get("title", "")}"</p><p>Artist: {song.get("artist", "")}</p></td></tr>'
-        songs_collection.update_one({'_id': song['_id']}, {'$set': {'logged': True}})
+    if song_count == 0:
+        logging.info(f"😮‍💨 No songs since last email 😮‍💨")
+        return
+
+    try:
+        rows = []
+        for song in songs_collection.find({'summary_run': run_id}, {'_id': 0, 'image_url': 1, 'title': 1, 'artist': 1}):
+            rows.append(f'<tr><td><img src="{song.get("image_url", "")}" width="128px"></td><td><p>Title: "{song.get("title", "")}"</p><p>Artist: {song.get("artist", "")}</p></td></tr>')
+        table_data = ''.join(rows)
 
-    if song_count > 0:
         with open('email.html', 'r') as html_file:
             html_email = html_file.read().replace('###table_data###', table_data)
 
@@ -48,9 +72,18 @@ def daily_summary():
         with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
             smtp.login(credentials['email'], credentials['password'])
             smtp.send_message(msg)
-        logging.info(f"Sent summary email for {song_count} songs.")
-    else:
-        logging.info(f"😮‍💨 No songs since last email 😮‍💨")
+    except Exception:
+        release_claimed_songs(run_id)
+        logging.error(f"Summary email for {song_count} songs failed; they stay unlogged for the next run", exc_info=True)
+        raise
+
+    commit_claimed_songs(run_id)
+    logging.info(f"Sent summary email for {song_count} songs.")
 
 if __name__ == '__main__':
-    daily_summary()
+    initialize()
+    with job_lock('summary') as acquired:
+        if acquired:
+            daily_summary()
+        else:
+            logging.info("Summary is already running (cron or daemon), skipping")
@@ -1,30 +1,264 @@
-import requests, json, time, datetime, pprint, logging, string, smtplib, os
-from email.message import EmailMessage
-from pprint import pformat
-from pathlib import Path
-import __main__
+import json, time, datetime, logging, os, tempfile, threading, random
+from metrics_v3 import metrics
+
+# Importing this module has no side effects: requests, smtplib and the credentials file are only
+# touched once something needs them, so light CLI commands start quickly. Entry points call
+# initialize() to set up the log file and load creds_v3.json.
+
+SPOTIFY_API_URL = 'https://api.spotify.com'
+SPOTIFY_ACCOUNTS_URL = 'https://accounts.spotify.com'
+
+# Filled in place by load_credentials(), so `from utilities_v3 import *` callers see the loaded values
+credentials = {}
+
+_init_lock = threading.Lock()
+_token_manager = None
+_spotify_client = None
+
+
+def configure_logging(script_name=None):
+    """Log to ./logs/<date>_<script>.log, named after the running script unless script_name is given"""
+    if script_name is None:
+        import __main__
+        script_name = os.path.splitext(os.path.basename(getattr(__main__, '__file__', None) or 'interactive'))[0]
+    logging.basicConfig(
+        level=logging.INFO,
+        format="\n[%(levelname)s] %(asctime)s -- %(filename)s on line %(lineno)s\n\tFunction name: %(funcName)s\n\tMessage: %(message)s\n",
+        datefmt='%B-%d-%Y %H:%M:%S',
+        filename=f"./logs/{datetime.datetime.today().strftime('%Y-%m-%d')}_{script_name}.log",
+        filemode='a',
+        force=True
+    )
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="\n[%(levelname)s] %(asctime)s -- %(filename)s on line %(lineno)s\n\tFunction name: %(funcName)s\n\tMessage: %(message)s\n",
-    datefmt='%B-%d-%Y %H:%M:%S',
-    filename=f"./logs/{datetime.datetime.today().strftime('%Y-%m-%d')}_{Path(__main__.__file__).stem}.log",
-    filemode='a'
-)
 
-with open('creds_v3.json') as file:
-    credentials = json.load(file)
+def load_credentials(creds_path='creds_v3.json') -> dict:
+    """Read creds_v3.json into the shared credentials dict the first time it is needed"""
+    if not credentials:
+        with _init_lock:
+            if not credentials:
+                with open(creds_path) as file:
+                    credentials.update(json.load(file))
+    return credentials
+
+
+def initialize(script_name=None):
+    """Explicit start-up for entry points: configure the log file and load the credentials"""
+    configure_logging(script_name)
+    return load_credentials()
+
+
+class TokenManager:
+    """Holds the Spotify access token in memory and refreshes it shortly before it expires"""
+
+    def __init__(self, creds_path='creds_v3.json', refresh_margin=60, credentials=None, accounts_url=SPOTIFY_ACCOUNTS_URL):
+        self.creds_path = creds_path
+        self.refresh_margin = refresh_margin
+        self.accounts_url = accounts_url
+        self.lock = threading.Lock()
+        if credentials is None:
+            with open(creds_path) as file:
+                credentials = json.load(file)
+        self.credentials = credentials
+
+    def get_token(self) -> str:
+        """Return a valid access token, refreshing it first if it expires within refresh_margin seconds"""
+        with self.lock:
+            if self.credentials.get('expires_integer', 0) - self.refresh_margin < time.time():
+                self._refresh()
+            return self.credentials['access_token'][0]
+
+    def force_refresh(self) -> str:
+        """Refresh the access token now, e.g. after Spotify rejected it with a 401"""
+        with self.lock:
+            self._refresh()
+            return self.credentials['access_token'][0]
+
+    def _refresh(self):
+        import requests
+
+        access_params = {
+            "client_id": self.credentials['client_id'],
+            "client_secret": self.credentials['client_secret'],
+            'grant_type': 'refresh_token',
+            'refresh_token': self.credentials['refresh_token'][0],
+            'redirect_uri': self.credentials['redirect_uri']
+        }
+
+        started = time.monotonic()
+        try:
+            response = requests.post(
+                f'{self.accounts_url}/api/token',
+                data=access_params,
+                timeout=10
+            )
+        except requests.RequestException:
+            metrics.record_spotify_request('POST', f'{self.accounts_url}/api/token', 'error', time.monotonic() - started)
+            raise
+        metrics.record_spotify_request('POST', f'{self.accounts_url}/api/token', response.status_code, time.monotonic() - started)
+        access_response = response.json()
+
+        self.store_tokens(access_response)
+        logging.info(f"Refreshed access token, valid until {self.credentials['expires_readable'][0]}")
+
+    def store_tokens(self, access_response):
+        """Apply a token endpoint response and persist the credentials if the token changed"""
+        changed = [access_response['access_token']] != self.credentials.get('access_token')
+
+        # Tokens are stored as one-element lists to stay compatible with existing creds files
+        self.credentials['access_token'] = [access_response['access_token']]
+        if 'refresh_token' in access_response:
+            changed = changed or [access_response['refresh_token']] != self.credentials.get('refresh_token')
+            self.credentials['refresh_token'] = [access_response['refresh_token']]
+        self.credentials['expires_readable'] = [datetime.datetime.fromtimestamp(time.time() + int(access_response['expires_in'])).strftime('%Y-%m-%d %H:%M:%S')]
+        self.credentials['expires_integer'] = time.time() + int(access_response['expires_in'])
+
+        if changed:
+            self.save()
+
+    def save(self):
+        """Atomically rewrite the credentials file"""
+        directory = os.path.dirname(os.path.abspath(self.creds_path))
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, delete=False, suffix='.tmp') as f:
+            json.dump(self.credentials, f, ensure_ascii=False, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f.name, self.creds_path)
+
+
+class SpotifyClient:
+    """Shared keep-alive session for the Spotify Web API with timeouts, 429 handling and retries"""
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    # Adding tracks is not idempotent, so POSTs are only retried when Spotify rejected them outright
+    IDEMPOTENT_METHODS = {'GET', 'DELETE'}
+
+    def __init__(self, token_manager, pool_size=16, timeout=10, max_retries=5, backoff_base=0.5, backoff_max=30, api_url=SPOTIFY_API_URL):
+        self.token_manager = token_manager
+        self.api_url = api_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs) -> 'requests.Response':
+        """Send a request with the current bearer token, retrying 401/429/5xx and connection errors"""
+        import requests
+
+        # Lets the helpers keep their api.spotify.com URLs while talking to a stand-in such as fake_spotify_v3.py
+        if self.api_url != SPOTIFY_API_URL and url.startswith(SPOTIFY_API_URL):
+            url = self.api_url + url[len(SPOTIFY_API_URL):]
+        kwargs.setdefault('timeout', self.timeout)
+        headers = dict(kwargs.pop('headers', None) or {})
+        refreshed = False
+        attempt = 0
+
+        while True:
+            headers['Authorization'] = f'Bearer {self.token_manager.get_token()}'
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                metrics.record_spotify_request(method, url, 'error', time.monotonic() - started)
+                if attempt >= self.max_retries or method not in self.IDEMPOTENT_METHODS:
+                    raise
+                delay = self._backoff(attempt)
+                logging.warning(f"{method} {url} failed with {err!r}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            metrics.record_spotify_request(method, url, response.status_code, time.monotonic() - started)
+
+            if response.status_code == 401 and not refreshed:
+                # Token was revoked or expired early - refresh once and try again
+                self.token_manager.force_refresh()
+                refreshed = True
+                continue
+
+            retryable = response.status_code == 429 or method in self.IDEMPOTENT_METHODS
+            if response.status_code in self.RETRY_STATUSES and retryable and attempt < self.max_retries:
+                retry_after = response.headers.get('Retry-After')
+                if response.status_code == 429 and retry_after and retry_after.isdigit():
+                    delay = int(retry_after) + random.uniform(0, 1)
+                else:
+                    delay = self._backoff(attempt)
+                logging.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            return response
+
+    def _backoff(self, attempt):
+        # Full jitter: uniform between 0 and the capped exponential delay
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+
+def get_token_manager() -> TokenManager:
+    """The process-wide TokenManager, created from the shared credentials on first use"""
+    global _token_manager
+    if _token_manager is None:
+        load_credentials()
+        with _init_lock:
+            if _token_manager is None:
+                _token_manager = TokenManager(
+                    'creds_v3.json',
+                    credentials=credentials,
+                    accounts_url=credentials.get('http', {}).get('accounts_url', SPOTIFY_ACCOUNTS_URL)
+                )
+    return _token_manager
+
+
+def get_spotify_client() -> SpotifyClient:
+    """The process-wide SpotifyClient, configured from the 'http' section of creds_v3.json on first use"""
+    global _spotify_client
+    if _spotify_client is None:
+        token_manager = get_token_manager()
+        with _init_lock:
+            if _spotify_client is None:
+                http_config = credentials.get('http', {})
+                _spotify_client = SpotifyClient(
+                    token_manager,
+                    pool_size=http_config.get('pool_size', 16),
+                    timeout=http_config.get('timeout', 10),
+                    max_retries=http_config.get('max_retries', 5),
+                    api_url=http_config.get('api_url', SPOTIFY_API_URL)
+                )
+    return _spotify_client
+
+
+class LazySpotifyClient:
+    """Stands in for the SpotifyClient until the first request"""
+
+    def __getattr__(self, name):
+        return getattr(get_spotify_client(), name)
+
+spotify_client = LazySpotifyClient()
 
-pp = pprint.PrettyPrinter(indent=2)
 
 today_with_time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
 def get_auth_token():
-    with open('creds_v3.json') as file:
-        credentials = json.load(file)
+    import requests
 
-    auth_token = credentials['auth_token']
-    access_token = credentials['access_token']
+    token_manager = get_token_manager()
+    credentials = token_manager.credentials
 
     token_headers = {
         'client_id': credentials['client_id'],
@@ -41,20 +275,16 @@ def get_auth_token():
     auth_token = input('Paste your token from the URL.   ').strip()
     
     credentials['auth_token'] = auth_token.replace('https://github.com/tophermckee?code=', '')
-
-    with open('creds_v3.json', 'w', encoding='utf-8') as f:
-        json.dump(credentials, f, ensure_ascii=False, indent=4)
-        f.close()
+    token_manager.save()
 
     return auth_token
 
 
 def get_access_token():
-    with open('creds_v3.json') as file:
-        credentials = json.load(file)
+    import requests
 
-    auth_token = credentials['auth_token']
-    access_token = credentials['access_token']
+    token_manager = get_token_manager()
+    credentials = token_manager.credentials
     
     access_params = {
         "client_id": credentials['client_id'],
@@ -71,100 +301,52 @@ def get_access_token():
 
     logging.info(f'\n{access_response}\n')
 
-    credentials['access_token'] = access_response['access_token'],
-    credentials['refresh_token'] = access_response['refresh_token'],
-    credentials['expires_readable'] = datetime.datetime.fromtimestamp(time.time() + int(access_response['expires_in'])).strftime('%Y-%m-%d %H:%M:%S'),
-    credentials['expires_integer'] = time.time() + int(access_response['expires_in'])
-
-    with open('creds_v3.json', 'w', encoding='utf-8') as f:
-        json.dump(credentials, f, ensure_ascii=False, indent=4)
-        f.close()
+    token_manager.store_tokens(access_response)
 
 
 def refresh_token():
-    with open('creds_v3.json') as file:
-        credentials = json.load(file)
-
-    auth_token = credentials['auth_token']
-    access_token = credentials['access_token']
-
-    access_params = {
-        "client_id": credentials['client_id'],
-        "client_secret": credentials['client_secret'],
-        'grant_type': 'refresh_token',
-        'refresh_token': credentials['refresh_token'][0],
-        'redirect_uri': credentials['redirect_uri']
-    }
-
-    access_response = requests.post(
-        'https://accounts.spotify.com/api/token',
-        data=access_params
-    ).json()
-
-    credentials['access_token'] = access_response['access_token'],
-    credentials['expires_readable'] = datetime.datetime.fromtimestamp(time.time() + int(access_response['expires_in'])).strftime('%Y-%m-%d %H:%M:%S'),
-    credentials['expires_integer'] = time.time() + int(access_response['expires_in'])
+    """Return a valid access token, only hitting the token endpoint when the current one is about to expire"""
+    return get_token_manager().get_token()
 
-    with open('creds_v3.json', 'w', encoding='utf-8') as f:
-        json.dump(credentials, f, ensure_ascii=False, indent=4)
 
-    return access_response['access_token']
+def add_songs_to_spotify(uris: list, playlist_id: str) -> dict:
+    """Add many URIs to a playlist, at most 100 per request, and return the snapshot_id and per-URI outcome"""
+    headers = {'Content-Type': 'application/json'}
+    result = {'snapshot_id': None, 'added': [], 'failed': []}
 
+    for start in range(0, len(uris), 100):
+        chunk = uris[start:start + 100]
+        payload = json.dumps({"uris": chunk})
 
-def add_song_to_spotify(uri: str, playlist_id: str, title: str, artist: str):
-    with open('creds_v3.json') as file:
-        credentials = json.load(file)
+        try:
+            addition = spotify_client.post(f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks", headers=headers, data=payload)
 
-    auth_token = credentials['auth_token']
-    access_token = credentials['access_token'][0]
+            if addition.status_code in (200, 201):
+                result['snapshot_id'] = addition.json().get('snapshot_id')
+                result['added'].extend(chunk)
+                logging.info(f"Successfully added {len(chunk)} songs to playlist {playlist_id}")
+            else:
+                result['failed'].extend(chunk)
+                logging.error(f"Failed to add {len(chunk)} songs. Status code: {addition.status_code}, Response: {addition.text}")
 
-    logging.info(f"Attempting to add \'{title.translate(str.maketrans('', '', string.punctuation))}\' by {artist} with uri {uri}")
-    
-    headers = {'Authorization': f'Bearer {credentials["access_token"][0]}', 'Content-Type': 'application/json'}
-
-    payload = json.dumps({
-        "uris": [uri]
-    })
-
-    try:
-        addition = requests.post(f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks", headers=headers, data=payload)
-        
-        if addition.status_code == 201:
-            logging.info(f"Successfully added \'{title}\' by {artist}")
-        else:
-            logging.error(f"Failed to add song. Status code: {addition.status_code}, Response: {addition.text}")
-            
-        return addition
-        
-    except Exception as error:
-        logging.error(f"Exception adding song to Spotify: {error}", exc_info=True)
-
-
-def check_token():
-    with open('creds_v3.json') as file:
-        credentials = json.load(file)
+        except Exception as error:
+            result['failed'].extend(chunk)
+            logging.error(f"Exception adding songs to Spotify: {error}", exc_info=True)
 
-    if credentials['expires_integer'] < time.time():
-        refresh_token()
-    else:
-        logging.info("Access token is still valid")
+    return result
 
 
 def return_playlist_length(playlist_id) -> int:
-    with open('creds_v3.json') as file:
-        credentials = json.load(file)
-    return requests.get(f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks', headers={'Authorization': f'Bearer {credentials["access_token"][0]}'}).json()['total']
+    return spotify_client.get(f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks').json()['total']
 
 
 def return_playlist_name(playlist_id) -> str:
-    with open('creds_v3.json') as file:
-        credentials = json.load(file)
-    return requests.get(f'https://api.spotify.com/v1/playlists/{playlist_id}', headers={'Authorization': f'Bearer {credentials["access_token"][0]}'}).json()['name']
+    return spotify_client.get(f'https://api.spotify.com/v1/playlists/{playlist_id}').json()['name']
 
 def send_summary_email(html_email, recipient):
-    with open('creds_v3.json') as file:
-        credentials = json.load(file)
-        
+    import smtplib
+    from email.message import EmailMessage
+
     with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
         smtp.login(credentials['email'], credentials['password'])
         
@@ -176,39 +358,76 @@ def send_summary_email(html_email, recipient):
         
         smtp.send_message(msg)
     
-def get_liked_tracks():
-    with open('creds_v3.json') as file:
-        credentials = json.load(file)
-    try:
-        liked_tracks = requests.get('https://api.spotify.com/v1/me/tracks?limit=50', headers={'Authorization': f'Bearer {credentials["access_token"][0]}'}).json()
-        logging.info(f"Retrieved {len(liked_tracks['items'])} liked tracks")
-    except Exception as err:
-        logging.error(f"Error getting liked tracks: {err}", exc_info=True)
-
-    return liked_tracks
+def iter_liked_tracks(batch_size=50):
+    """Yield every liked track in batches of batch_size, prefetching the next page while the caller works
+
+    Pages are read from the oldest end of the library towards the newest. Unliking a batch only shifts
+    tracks that come after it, so the offsets still to be read stay valid while the caller removes
+    processed tracks. Only the current and the next batch are ever held in memory.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    batch_size = max(1, min(50, batch_size))
+    total = spotify_client.get('https://api.spotify.com/v1/me/tracks', params={'limit': 1}).json().get('total', 0)
+    logging.info(f"Streaming {total} liked tracks in batches of {batch_size}")
+
+    def fetch_window(end):
+        start = max(0, end - batch_size)
+        response = spotify_client.get('https://api.spotify.com/v1/me/tracks', params={'offset': start, 'limit': end - start}).json()
+        if 'items' not in response:
+            logging.error(f"Unexpected response getting liked tracks at offset {start}: {response}")
+            return []
+        return response['items']
+
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        end = total
+        next_batch = prefetcher.submit(fetch_window, end) if end > 0 else None
+        while next_batch is not None:
+            items = next_batch.result()
+            end -= batch_size
+            next_batch = prefetcher.submit(fetch_window, end) if end > 0 else None
+            if items:
+                yield items
 
 def get_artist(artist_id):
-    with open('creds_v3.json') as file:
-        credentials = json.load(file)
     try:
-        artist = requests.get(f'https://api.spotify.com/v1/artists/{artist_id}', headers={'Authorization': f'Bearer {credentials["access_token"][0]}'}).json()
+        artist = spotify_client.get(f'https://api.spotify.com/v1/artists/{artist_id}').json()
     except Exception as err:
         logging.error(f"Error getting artist info for {artist_id}: {err}", exc_info=True)
 
     return artist
 
-def delete_song_from_likes(uri: str) -> None:
-    with open('creds_v3.json') as file:
-        credentials = json.load(file)
-    json_info = {"ids": [uri]}
-    payload = json.dumps(json_info)
-    try:
-        deletion = requests.delete('https://api.spotify.com/v1/me/tracks', headers={'Authorization': f'Bearer {credentials["access_token"][0]}', 'Content-Type': 'application/json'}, data=payload)
-        if deletion.status_code == 200:
-            logging.info(f"Successfully removed song {uri} from likes")
-        else:
-            logging.error(f"Failed to remove song from likes. Status: {deletion.status_code}, Response: {deletion.text}")
-    except Exception as err:
-        logging.error(f"Exception removing song from likes: {err}", exc_info=True)
-
-    return deletion
+def get_artists(artist_ids: list) -> list:
+    """Look up many artists with /v1/artists, at most 50 ids per request"""
+    artists = []
+
+    for start in range(0, len(artist_ids), 50):
+        chunk = artist_ids[start:start + 50]
+        try:
+            response = spotify_client.get('https://api.spotify.com/v1/artists', params={'ids': ','.join(chunk)}).json()
+            artists.extend(artist for artist in response.get('artists', []) if artist)
+        except Exception as err:
+            logging.error(f"Error getting artist info for {len(chunk)} artists: {err}", exc_info=True)
+
+    return artists
+
+def delete_songs_from_likes(ids: list) -> dict:
+    """Remove many tracks from Liked Songs, at most 50 ids per request, and report which ids failed"""
+    result = {'removed': [], 'failed': []}
+
+    for start in range(0, len(ids), 50):
+        chunk = ids[start:start + 50]
+        payload = json.dumps({"ids": chunk})
+        try:
+            deletion = spotify_client.delete('https://api.spotify.com/v1/me/tracks', headers={'Content-Type': 'application/json'}, data=payload)
+            if deletion.status_code == 200:
+                result['removed'].extend(chunk)
+                logging.info(f"Successfully removed {len(chunk)} songs from likes")
+            else:
+                result['failed'].extend(chunk)
+                logging.error(f"Failed to remove {len(chunk)} songs from likes. Status: {deletion.status_code}, Response: {deletion.text}")
+        except Exception as err:
+            result['failed'].extend(chunk)
+            logging.error(f"Exception removing songs from likes: {err}", exc_info=True)
+
+    return result